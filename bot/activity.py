@@ -0,0 +1,126 @@
+# bot/activity.py
+import asyncio
+import logging
+import os
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from db.database import get_async_db
+from db.models import UserActivity
+from bot.rollups import aggregate, upsert_statements
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_S = float(os.getenv("ACTIVITY_FLUSH_INTERVAL_S", "2"))
+FLUSH_BATCH_SIZE = int(os.getenv("ACTIVITY_FLUSH_BATCH_SIZE", "200"))
+MAX_BUFFER = int(os.getenv("ACTIVITY_MAX_BUFFER", "20000"))
+# строка, которую БД отвергает и в одиночку, отбрасывается после стольких сбросов
+MAX_ATTEMPTS = int(os.getenv("ACTIVITY_MAX_ATTEMPTS", "3"))
+
+# БД недоступна или занята: дело не в строках, пачку надо повторить целиком позже
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+# Копит готовые строки user_activity в памяти и пишет их пачками одним INSERT в фоне,
+# в той же транзакции обновляя агрегаты activity_rollups
+class ActivitySink:
+    def __init__(
+        self, flush_interval_s: float = FLUSH_INTERVAL_S, batch_size: int = FLUSH_BATCH_SIZE,
+        max_buffer: int = MAX_BUFFER, max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.flush_interval = flush_interval_s
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.max_attempts = max_attempts
+        self._buffer: list[dict] = []
+        # пачки, не записанные при прошлых сбросах, с числом неудачных попыток; пишутся первыми
+        self._retry: list[tuple[list[dict], int]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def record(self, **row) -> None:
+        self._buffer.append(row)
+        self._trim()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._buffer) + sum(len(batch) for batch, _ in self._retry)
+
+    # БД недоступна дольше, чем помещается в буфер: теряем самые старые строки, а не память
+    def _trim(self) -> None:
+        excess = self.pending() - self.max_buffer
+        if excess <= 0:
+            return
+        dropped = excess
+        while excess and self._retry:
+            batch, attempts = self._retry[0]
+            if len(batch) <= excess:
+                excess -= len(batch)
+                self._retry.pop(0)
+            else:
+                self._retry[0] = (batch[excess:], attempts)
+                excess = 0
+        del self._buffer[:excess]
+        logger.warning("Буфер активности переполнен, отброшено %d строк", dropped)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="activity-sink")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            batches = self._retry + [(rows[i:i + self.batch_size], 0) for i in range(0, len(rows), self.batch_size)]
+            self._retry = []
+            # стек: следующая пачка — в конце списка
+            todo = batches[::-1]
+            while todo:
+                batch, attempts = todo.pop()
+                try:
+                    await self._write(batch)
+                except TRANSIENT_ERRORS:
+                    logger.exception("БД недоступна, %d строк активности ждут следующего сброса", len(batch))
+                    todo.append((batch, attempts))
+                    self._retry.extend(todo[::-1])
+                    break
+                except Exception:
+                    if len(batch) > 1:
+                        # пачку отвергла сама БД: делим пополам, пока не останется строка, из-за которой она падает
+                        mid = len(batch) // 2
+                        todo.append((batch[mid:], attempts))
+                        todo.append((batch[:mid], attempts))
+                    elif attempts + 1 >= self.max_attempts:
+                        logger.exception("Строка активности отброшена после %d попыток: %r", attempts + 1, batch[0])
+                    else:
+                        logger.exception("Не удалось записать строку активности, повтор при следующем сбросе")
+                        self._retry.append((batch, attempts + 1))
+            self._trim()
+
+    @staticmethod
+    async def _write(rows: list[dict]) -> None:
+        async with get_async_db() as db:
+            await db.execute(insert(UserActivity).values(rows))
+            for stmt in upsert_statements(db.bind.dialect.name, aggregate(rows)):
+                await db.execute(stmt)
+            await db.commit()
+
+activity_sink = ActivitySink()
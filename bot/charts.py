@@ -0,0 +1,82 @@
+# bot/charts.py
+import asyncio
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "32"))
+# счётчик текущего дня растёт с каждым запросом; график перерисовывается не чаще раза за такой интервал
+CHART_LIVE_BUCKET_S = float(os.getenv("CHART_LIVE_BUCKET_S", "3600"))
+
+class Chart(NamedTuple):
+    key: str
+    png: bytes
+    file_id: str | None
+
+def _render_requests_by_day(days: list[str], counts: list[int]) -> bytes:
+    # объектный API и Agg-канвас: никакого глобального состояния pyplot, можно рисовать из воркера
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(6, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(days, counts, marker="o")
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment("right")
+    ax.set_title("Запросы по дням")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel("Количество запросов")
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+# Рисует графики в отдельном потоке и кэширует PNG и file_id, полученный от Telegram при первой отправке
+class ChartService:
+    def __init__(self, cache_size: int = CHART_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="charts")
+        self._cache: OrderedDict[str, Chart] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def requests_by_day(self, days: list[str], counts: list[int]) -> Chart:
+        # в ключе только завершённые дни (границы дней в rollup — по UTC) и номер интервала для сегодняшнего:
+        # иначе живой счётчик сегодняшнего дня менял бы ключ при каждом вызове
+        completed, live = (days, counts), None
+        if days and days[-1] == datetime.now(timezone.utc).date().isoformat():
+            completed, live = (days[:-1], counts[:-1]), (days[-1], int(time.time() // CHART_LIVE_BUCKET_S))
+        key = "requests_by_day:" + hashlib.sha1(repr((completed, live)).encode()).hexdigest()
+        return await self._get(key, _render_requests_by_day, days, counts)
+
+    def remember_file_id(self, key: str, file_id: str) -> None:
+        chart = self._cache.get(key)
+        if chart and chart.file_id is None:
+            self._cache[key] = chart._replace(file_id=file_id)
+
+    async def _get(self, key: str, render, *args) -> Chart:
+        chart = self._cache.get(key)
+        if chart:
+            self._cache.move_to_end(key)
+            return chart
+        # одинаковые запросы, пришедшие во время рендеринга, ждут один и тот же результат
+        if key not in self._inflight:
+            loop = asyncio.get_running_loop()
+            self._inflight[key] = loop.run_in_executor(self._executor, render, *args)
+        try:
+            png = await self._inflight[key]
+        finally:
+            self._inflight.pop(key, None)
+        chart = self._cache.get(key) or Chart(key, png, None)
+        self._cache[key] = chart
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return chart
+
+chart_service = ChartService()
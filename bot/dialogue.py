@@ -0,0 +1,158 @@
+# bot/dialogue.py
+import asyncio
+import hashlib
+import os
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Any, NamedTuple
+
+# бюджет контекста в токенах: история + новая реплика пользователя (ответ генерируется сверх него)
+DIALOGUE_MAX_TOKENS = int(os.getenv("DIALOGUE_MAX_TOKENS", "512"))
+# при переполнении старые реплики срезаются до этой доли бюджета, а не по одной:
+# после среза кэш ключей/значений становится недействителен, и пересчитывать его на каждом ходу дорого
+DIALOGUE_TRIM_TO = float(os.getenv("DIALOGUE_TRIM_TO", "0.5"))
+DIALOGUE_MAX_TURN_TOKENS = int(os.getenv("DIALOGUE_MAX_TURN_TOKENS", "256"))
+DIALOGUE_IDLE_TTL_S = float(os.getenv("DIALOGUE_IDLE_TTL_S", "1800"))
+DIALOGUE_MAX_CHATS = int(os.getenv("DIALOGUE_MAX_CHATS", "10000"))
+# past_key_values держится лишь для нескольких последних активных чатов:
+# для ruDialoGPT-medium это около 0.2 МБ на токен, т.е. до ~100 МБ на чат при полном бюджете
+DIALOGUE_KV_CHATS = int(os.getenv("DIALOGUE_KV_CHATS", "4"))
+
+class KvCache(NamedTuple):
+    # токены, которые уже прогнаны через модель и лежат в past
+    token_ids: array
+    past: Any
+
+# Один ход генерации: входные токены целиком и кэш предыдущего хода; движок заполняет ответ и новый кэш
+class Continuation:
+    def __init__(self, input_ids: array, kv: KvCache | None = None):
+        self.input_ids = input_ids
+        self.kv = kv
+        self.answer_ids = array("I")
+
+# История одного чата: реплики хранятся как массивы token id, а не как строки и списки int
+class Dialogue:
+    def __init__(self, store: "DialogueStore"):
+        self.store = store
+        self.turns: deque[array] = deque()
+        self.tokens = 0
+        self.kv: KvCache | None = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def user_turn(self, text: str) -> array:
+        tokenizer = self.store.tokenizer
+        # длинное сообщение обрезается по тексту, а маркер "<Bot>:" остаётся на месте
+        ids = tokenizer.encode(f"<User>: {text}")[: self.store.max_turn_tokens]
+        return array("I", ids + self.store.bot_marker)
+
+    def bot_turn(self, answer: str) -> array:
+        return array("I", self.store.tokenizer.encode(f" {answer}") + self.store.newline)
+
+    def answer_turn(self, answer_ids: array) -> array:
+        return answer_ids + array("I", self.store.newline)
+
+    def continuation(self, user_ids: array) -> Continuation:
+        self._fit(len(user_ids))
+        input_ids = array("I")
+        for turn in self.turns:
+            input_ids.extend(turn)
+        input_ids.extend(user_ids)
+        # кэш уходит в генерацию целиком: движок меняет его на месте, а вернётся он только через add()
+        # после успешного ответа — таймаут или ошибка не оставят чату наполовину обрезанный past
+        kv, self.kv = self.kv, None
+        self.store._with_kv.pop(id(self), None)
+        return Continuation(input_ids, kv)
+
+    # отпечаток истории для ключа кэша ответов: та же история и тот же вопрос дают тот же жадный ответ
+    def context_key(self) -> str:
+        digest = hashlib.sha256()
+        for turn in self.turns:
+            digest.update(turn.tobytes())
+        return digest.hexdigest()
+
+    def add(self, user_ids: array, bot_ids: array, kv: KvCache | None = None) -> None:
+        self._fit(len(user_ids) + len(bot_ids))
+        self.turns.append(user_ids)
+        self.turns.append(bot_ids)
+        self.tokens += len(user_ids) + len(bot_ids)
+        if kv is not None:
+            self.store._keep_kv(self, kv)
+
+    def prompt(self, user_ids: array) -> str:
+        return self.store.tokenizer.decode(user_ids)
+
+    def _fit(self, incoming: int) -> None:
+        if self.tokens + incoming <= self.store.max_tokens:
+            return
+        target = max(self.store.max_tokens * self.store.trim_to - incoming, 0)
+        while self.turns and self.tokens > target:
+            # реплики уходят парами: вопрос и ответ на него
+            for _ in range(min(2, len(self.turns))):
+                self.tokens -= len(self.turns.popleft())
+
+# chat_id → Dialogue, с вытеснением по простою и по LRU
+class DialogueStore:
+    def __init__(
+        self, tokenizer,
+        max_tokens: int = DIALOGUE_MAX_TOKENS, trim_to: float = DIALOGUE_TRIM_TO,
+        max_turn_tokens: int = DIALOGUE_MAX_TURN_TOKENS, idle_ttl_s: float = DIALOGUE_IDLE_TTL_S,
+        max_chats: int = DIALOGUE_MAX_CHATS, kv_chats: int = DIALOGUE_KV_CHATS,
+    ):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.trim_to = trim_to
+        self.max_turn_tokens = max_turn_tokens
+        self.idle_ttl = idle_ttl_s
+        self.max_chats = max_chats
+        self.kv_chats = kv_chats
+        self.bot_marker = tokenizer.encode("\n<Bot>:")
+        self.newline = tokenizer.encode("\n")
+        self._dialogues: OrderedDict[int, Dialogue] = OrderedDict()
+        self._with_kv: OrderedDict[int, Dialogue] = OrderedDict()
+
+    def get(self, chat_id: int) -> Dialogue:
+        self._evict_idle()
+        dialogue = self._dialogues.get(chat_id)
+        if dialogue is None:
+            dialogue = self._dialogues[chat_id] = Dialogue(self)
+            while len(self._dialogues) > self.max_chats:
+                self._drop(next(iter(self._dialogues)))
+        self._dialogues.move_to_end(chat_id)
+        dialogue.last_used = time.monotonic()
+        return dialogue
+
+    def reset(self, chat_id: int) -> None:
+        self._drop(chat_id)
+
+    def count(self) -> int:
+        return len(self._dialogues)
+
+    # чаты, у которых сейчас хранится past_key_values
+    def kv_count(self) -> int:
+        return len(self._with_kv)
+
+    def _keep_kv(self, dialogue: Dialogue, kv: KvCache) -> None:
+        dialogue.kv = kv
+        key = id(dialogue)
+        self._with_kv[key] = dialogue
+        self._with_kv.move_to_end(key)
+        while len(self._with_kv) > self.kv_chats:
+            _, oldest = self._with_kv.popitem(last=False)
+            oldest.kv = None
+
+    def _drop(self, chat_id: int) -> None:
+        dialogue = self._dialogues.pop(chat_id, None)
+        if dialogue is not None:
+            dialogue.kv = None
+            self._with_kv.pop(id(dialogue), None)
+
+    def _evict_idle(self) -> None:
+        # словарь упорядочен по последнему обращению, просроченные чаты лежат в начале
+        expire_before = time.monotonic() - self.idle_ttl
+        while self._dialogues:
+            chat_id, oldest = next(iter(self._dialogues.items()))
+            if oldest.last_used >= expire_before or oldest.lock.locked():
+                break
+            self._drop(chat_id)
@@ -0,0 +1,90 @@
+# bot/faq.py
+import csv
+import json
+import logging
+import os
+import zlib
+from typing import NamedTuple
+import numpy as np
+from bot.response_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+FAQ_INDEX_PATH = os.getenv("FAQ_INDEX_PATH", "data/faq_index")
+FAQ_MIN_SIMILARITY = float(os.getenv("FAQ_MIN_SIMILARITY", "0.85"))
+FAQ_TOP_K = int(os.getenv("FAQ_TOP_K", "3"))
+EMBEDDING_DIM = int(os.getenv("FAQ_EMBEDDING_DIM", "2048"))
+NGRAM_SIZE = 3
+
+class FaqMatch(NamedTuple):
+    row: int
+    score: float
+    question: str
+    answer: str
+    intent: str
+
+# Хэширование символьных n-грамм нормализованного текста в вектор фиксированной длины.
+# Устойчиво к опечаткам и перестановке слов, не требует отдельной модели и считается за микросекунды.
+def embed(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    vec = np.zeros(dim, dtype=np.float32)
+    for word in normalize_prompt(text).split():
+        padded = f" {word} "
+        for i in range(max(len(padded) - NGRAM_SIZE + 1, 1)):
+            h = zlib.crc32(padded[i:i + NGRAM_SIZE].encode())
+            vec[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def build_index(csv_path: str, index_path: str = FAQ_INDEX_PATH, dim: int = EMBEDDING_DIM) -> int:
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if r.get("question") and r.get("answer")]
+    matrix = np.vstack([embed(r["question"], dim) for r in rows]) if rows else np.zeros((0, dim), dtype=np.float32)
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    np.save(f"{index_path}.npy", matrix)
+    meta = {
+        "dim": dim,
+        "ngram": NGRAM_SIZE,
+        "questions": [r["question"].strip() for r in rows],
+        "answers": [r["answer"].strip() for r in rows],
+        "intents": [(r.get("category") or "").strip() for r in rows],
+    }
+    with open(f"{index_path}.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return len(rows)
+
+# Индекс вопросов FAQ: матрица нормированных векторов (memory-mapped .npy) и ответы к ним
+class FaqIndex:
+    def __init__(self, matrix: np.ndarray, questions: list[str], answers: list[str], intents: list[str]):
+        self.matrix = matrix
+        self.questions = questions
+        self.answers = answers
+        self.intents = intents
+        self.dim = matrix.shape[1]
+
+    @classmethod
+    def load(cls, index_path: str = FAQ_INDEX_PATH) -> "FaqIndex | None":
+        if not os.path.exists(f"{index_path}.npy"):
+            return None
+        with open(f"{index_path}.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("ngram") != NGRAM_SIZE:
+            logger.warning("Индекс FAQ %s собран с другими параметрами, пересоберите его", index_path)
+            return None
+        matrix = np.load(f"{index_path}.npy", mmap_mode="r")
+        return cls(matrix, meta["questions"], meta["answers"], meta["intents"])
+
+    def search(self, text: str, k: int = FAQ_TOP_K) -> list[FaqMatch]:
+        if not len(self.answers):
+            return []
+        scores = self.matrix @ embed(text, self.dim)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            FaqMatch(int(i), float(scores[i]), self.questions[i], self.answers[i], self.intents[i] or f"faq_{i}")
+            for i in top
+        ]
+
+    def match(self, text: str, min_similarity: float = FAQ_MIN_SIMILARITY) -> FaqMatch | None:
+        best = self.search(text, 1)
+        return best[0] if best and best[0].score >= min_similarity else None
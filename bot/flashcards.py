@@ -0,0 +1,243 @@
+# bot/flashcards.py
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from sqlalchemy import func, insert, select, true, update
+from db.database import get_async_db
+from db.models import Flashcard, FlashcardReview, User, UserSetting
+from bot import metrics
+from bot.activity import TRANSIENT_ERRORS
+from bot.reminders import send_notification
+
+logger = logging.getLogger(__name__)
+
+FLASHCARD_SESSION_SIZE = int(os.getenv("FLASHCARD_SESSION_SIZE", "20"))
+FLASHCARD_FLUSH_INTERVAL_S = float(os.getenv("FLASHCARD_FLUSH_INTERVAL_S", "5"))
+FLASHCARD_FLUSH_BATCH_SIZE = int(os.getenv("FLASHCARD_FLUSH_BATCH_SIZE", "500"))
+# карточка, запись которой БД отвергает и в одиночку, отбрасывается после стольких сбросов
+FLASHCARD_MAX_ATTEMPTS = int(os.getenv("FLASHCARD_MAX_ATTEMPTS", "3"))
+FLASHCARD_MAX_BUFFER = int(os.getenv("FLASHCARD_MAX_BUFFER", "20000"))
+# «Снова»: карточка возвращается в очередь через несколько минут, а не на следующий день
+FLASHCARD_RELEARN_DELAY_S = float(os.getenv("FLASHCARD_RELEARN_DELAY_S", "600"))
+FLASHCARD_NOTIFY_INTERVAL_S = float(os.getenv("FLASHCARD_NOTIFY_INTERVAL_S", "3600"))
+FLASHCARD_NOTIFY_MIN_DUE = int(os.getenv("FLASHCARD_NOTIFY_MIN_DUE", "1"))
+FLASHCARD_NOTIFY_RATE = float(os.getenv("FLASHCARD_NOTIFY_RATE", "20"))
+MIN_EASE = 1.3
+
+NOTIFY_TEXT = "🃏 К повторению {count} карточек. Начать: /review"
+
+notifications_total = metrics.registry.counter(
+    "bot_flashcard_notifications_total", "Уведомления о карточках к повторению по исходу", ("outcome",),
+)
+
+class CardState(NamedTuple):
+    ease: float
+    interval_days: float
+    repetitions: int
+    due_at: datetime
+
+# SM-2: quality 0–5, ниже 3 — карточка не вспомнена и изучается заново
+def sm2(ease: float, interval_days: float, repetitions: int, quality: int, now: datetime) -> CardState:
+    if quality < 3:
+        # как в классическом SM-2: сбрасываются повторения, EF остаётся прежним
+        return CardState(ease, 0.0, 0, now + timedelta(seconds=FLASHCARD_RELEARN_DELAY_S))
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    repetitions += 1
+    if repetitions == 1:
+        interval_days = 1.0
+    elif repetitions == 2:
+        interval_days = 6.0
+    else:
+        interval_days = round(interval_days * ease)
+    return CardState(ease, interval_days, repetitions, now + timedelta(days=interval_days))
+
+# Копит результаты повторений и пишет их пачками: один INSERT в flashcard_reviews и один
+# UPDATE по первичному ключу для новых состояний карточек
+class ReviewLog:
+    def __init__(
+        self, flush_interval_s: float = FLASHCARD_FLUSH_INTERVAL_S, batch_size: int = FLASHCARD_FLUSH_BATCH_SIZE,
+        max_attempts: int = FLASHCARD_MAX_ATTEMPTS, max_buffer: int = FLASHCARD_MAX_BUFFER,
+    ):
+        self.flush_interval = flush_interval_s
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.max_buffer = max_buffer
+        self._reviews: list[dict] = []
+        # card_id → последнее состояние; несколько оценок одной карточки до сброса дают одну запись.
+        # Состояние остаётся здесь, пока не записано: due_cards сверяется с ним вместо БД
+        self._states: dict[int, dict] = {}
+        # card_id → число сбросов, на которых БД отвергла запись карточки в одиночку
+        self._attempts: dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def record(self, card_id: int, user_id: int, quality: int, state: CardState, reviewed_at: datetime) -> None:
+        self._reviews.append({
+            "card_id": card_id, "user_id": user_id, "review_time": reviewed_at,
+            "success": quality >= 3, "quality": quality,
+        })
+        self._states[card_id] = {"id": card_id, **state._asdict()}
+        if len(self._reviews) > self.max_buffer:
+            # история оценок теряется с самых старых строк; последние состояния карточек остаются в _states
+            dropped = len(self._reviews) - self.max_buffer
+            del self._reviews[:dropped]
+            logger.warning("Буфер повторений карточек переполнен, отброшено %d строк", dropped)
+        if len(self._reviews) >= self.batch_size:
+            self._wakeup.set()
+
+    # ещё не записанное в БД состояние: очередь повторения не должна снова выдать только что оценённую карточку
+    def pending_state(self, card_id: int) -> dict | None:
+        return self._states.get(card_id)
+
+    # карточки, оценённые до нового срока, пока оценка не записана в БД
+    def not_due(self, now: datetime) -> list[int]:
+        return [card_id for card_id, state in self._states.items() if state["due_at"] > now]
+
+    def pending(self) -> int:
+        return len(self._reviews)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="flashcard-reviews")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._states:
+                return
+            reviews, self._reviews = self._reviews, []
+            states = dict(self._states)
+            by_card: dict[int, list[dict]] = {}
+            for review in reviews:
+                by_card.setdefault(review["card_id"], []).append(review)
+            done: set[int] = set()
+            # стек групп карточек; группа, которую отвергла сама БД, делится пополам до одной карточки
+            todo = [list(states)]
+            while todo:
+                card_ids = todo.pop()
+                try:
+                    await self._write([r for c in card_ids for r in by_card.get(c, ())], [states[c] for c in card_ids])
+                except TRANSIENT_ERRORS:
+                    logger.exception("БД недоступна, повторения %d карточек ждут следующего сброса", len(states) - len(done))
+                    break
+                except Exception:
+                    if len(card_ids) > 1:
+                        mid = len(card_ids) // 2
+                        todo.extend((card_ids[mid:], card_ids[:mid]))
+                        continue
+                    card_id = card_ids[0]
+                    attempts = self._attempts.get(card_id, 0) + 1
+                    if attempts < self.max_attempts:
+                        logger.exception("Не удалось записать повторение карточки %d, повтор при следующем сбросе", card_id)
+                        self._attempts[card_id] = attempts
+                        continue
+                    logger.exception("Повторения карточки %d отброшены после %d попыток", card_id, attempts)
+                done.update(card_ids)
+                for card_id in card_ids:
+                    self._attempts.pop(card_id, None)
+                    # карточку могли оценить снова, пока шла запись: тогда её новое состояние ждёт следующего сброса
+                    if self._states.get(card_id) is states[card_id]:
+                        del self._states[card_id]
+            # незаписанные оценки возвращаются в начало буфера
+            self._reviews[:0] = [r for r in reviews if r["card_id"] not in done]
+
+    @staticmethod
+    async def _write(reviews: list[dict], states: list[dict]) -> None:
+        async with get_async_db() as db:
+            if reviews:
+                await db.execute(insert(FlashcardReview), reviews)
+            await db.execute(update(Flashcard), states)
+            await db.commit()
+
+review_log = ReviewLog()
+
+async def due_cards(user_id: int, limit: int = FLASHCARD_SESSION_SIZE) -> list[Flashcard]:
+    now = datetime.now(timezone.utc)
+    # только что оценённые карточки отсекаются в самом запросе, иначе очередь вернулась бы короче limit
+    not_due = review_log.not_due(now)
+    query = select(Flashcard).where(Flashcard.user_id == user_id, Flashcard.due_at <= now)
+    if not_due:
+        query = query.where(Flashcard.id.not_in(not_due))
+    async with get_async_db() as db:
+        # индекс (user_id, due_at): читаются только первые limit строк, сколько бы карточек ни было
+        return (await db.scalars(query.order_by(Flashcard.due_at).limit(limit))).all()
+
+async def card_counts(user_id: int) -> tuple[int, int]:
+    now = datetime.now(timezone.utc)
+    async with get_async_db() as db:
+        total, due = (await db.execute(
+            select(func.count(), func.count().filter(Flashcard.due_at <= now)).where(Flashcard.user_id == user_id)
+        )).one()
+    return total, due
+
+# Раз в интервал: одно сообщение на пользователя, у которого с прошлого прохода появились карточки к повторению
+class DueNotifier:
+    def __init__(self, interval_s: float = FLASHCARD_NOTIFY_INTERVAL_S, min_due: int = FLASHCARD_NOTIFY_MIN_DUE, rate: float = FLASHCARD_NOTIFY_RATE):
+        self.interval = interval_s
+        self.min_due = min_due
+        self.rate = rate
+        # после перезапуска смотрим на один интервал назад: пропуска нет, повтор — не больше одного
+        self._since = datetime.now(timezone.utc) - timedelta(seconds=interval_s)
+
+    def start(self, application) -> None:
+        if application.job_queue is None:
+            logger.warning("JobQueue недоступна, уведомления о карточках выключены")
+            return
+        application.job_queue.run_repeating(self._job, interval=self.interval, first=self.interval, name="flashcards-notify")
+
+    async def _job(self, context) -> None:
+        await self.notify(context.bot)
+
+    async def notify(self, bot) -> None:
+        now = datetime.now(timezone.utc)
+        since, self._since = self._since, now
+        async with get_async_db() as db:
+            # узкий диапазон по ix_flashcards_due_at: только карточки, наступившие с прошлого прохода
+            newly_due = (
+                select(Flashcard.user_id).where(Flashcard.due_at > since, Flashcard.due_at <= now).distinct()
+                .scalar_subquery()
+            )
+            rows = (await db.execute(
+                select(User.telegram_id, func.count(Flashcard.id))
+                .join(User, User.id == Flashcard.user_id)
+                .outerjoin(UserSetting, UserSetting.user_id == User.id)
+                .where(
+                    Flashcard.user_id.in_(newly_due),
+                    Flashcard.due_at <= now,
+                    User.telegram_id.is_not(None),
+                    func.coalesce(UserSetting.flashcard_notifications, true()),
+                    func.coalesce(UserSetting.notifications_enabled, true()),
+                )
+                .group_by(User.telegram_id)
+                .having(func.count(Flashcard.id) >= self.min_due)
+            )).all()
+        for chat_id, count in rows:
+            started = time.monotonic()
+            notifications_total.inc(outcome=await send_notification(bot, chat_id, NOTIFY_TEXT.format(count=count)))
+            await asyncio.sleep(max(0.0, 1 / self.rate - (time.monotonic() - started)))
+
+due_notifier = DueNotifier()
+
+metrics.registry.collected("bot_flashcard_reviews_pending", "Повторения карточек, ещё не записанные в БД", review_log.pending)
@@ -1,10 +1,13 @@
 # bot/handlers/admin.py
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from db.database import get_db
+from sqlalchemy import select
+from db.database import get_async_db
 from db.models import User, Role
 from bot.handlers.auth_utils import requires_role
 from bot.handlers.utils import log_activity
+from bot.identity import identity_cache
+from bot.sessions import session_store
 
 @log_activity("admin_panel")
 @requires_role(["admin"])
@@ -23,13 +26,12 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     data = query.data
 
-    with get_db() as db:
+    async with get_async_db() as db:
         if data == "admin_list_users":
-            users = db.query(User).all()
+            users = (await db.execute(select(User.username, Role.name).join(Role, Role.id == User.role_id))).all()
             text = "<b>Список всех пользователей:</b>\n"
-            for u in users:
-                role_name = db.query(Role).filter(Role.id == u.role_id).first().name
-                text += f"– {u.username} (роль: {role_name})\n"
+            for username, role_name in users:
+                text += f"– {username} (роль: {role_name})\n"
             await query.edit_message_text(text, parse_mode="HTML")
 
         elif data == "admin_add_role":
@@ -58,18 +60,21 @@ async def set_role_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         await update.message.reply_text("Роль должна быть одной из: admin, manager, client.")
         return
 
-    with get_db() as db:
-        user_obj = db.query(User).filter(User.username == username).first()
+    async with get_async_db() as db:
+        user_obj = await db.scalar(select(User).where(User.username == username))
         if not user_obj:
             await update.message.reply_text(f"Пользователь {username} не найден.")
             return
-        role_obj = db.query(Role).filter(Role.name == new_role).first()
+        role_obj = await db.scalar(select(Role).where(Role.name == new_role))
         if not role_obj:
             await update.message.reply_text(f"В системе нет роли {new_role}.")
             return
         user_obj.role_id = role_obj.id
         db.add(user_obj)
-        db.commit()
+        await db.commit()
+    identity_cache.invalidate(user_obj.telegram_id)
+    # у вошедших в аккаунт роль хранится в сессии: обновляем её, не дожидаясь повторного входа
+    await session_store.update_role(user_obj.id, new_role)
 
     await update.message.reply_text(f"Роль пользователя {username} изменена на {new_role}.")
 
@@ -1,10 +1,12 @@
 # bot/handlers/auth.py
-import bcrypt
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, ConversationHandler, MessageHandler, filters
-from db.database import get_db
+from sqlalchemy import select
+from db.database import get_async_db
 from db.models import User, Role
 from bot.handlers.utils import log_activity
+from bot.identity import identity_cache
+from bot.passwords import password_hasher
 
 (Reg_ASK_USERNAME, Reg_ASK_PASSWORD, Login_ASK_USERNAME, Login_ASK_PASSWORD) = range(4)
 
@@ -17,8 +19,8 @@ async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def register_username(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     username = update.message.text.strip()
     context.user_data["reg_username"] = username
-    with get_db() as db:
-        if db.query(User).filter(User.username == username).first():
+    async with get_async_db() as db:
+        if await db.scalar(select(User.id).where(User.username == username)):
             await update.message.reply_text("❌ Такой email уже зарегистрирован.")
             return Reg_ASK_USERNAME
     await update.message.reply_text("Введите пароль (минимум 8 символов):")
@@ -32,15 +34,15 @@ async def register_password(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return Reg_ASK_PASSWORD
 
     username = context.user_data["reg_username"]
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    hashed = await password_hasher.hash(password)
 
-    with get_db() as db:
-        role_obj = db.query(Role).filter(Role.name == "client").first()
+    async with get_async_db() as db:
+        role_obj = await db.scalar(select(Role).where(Role.name == "client"))
         if not role_obj:
             role_obj = Role(name="client")
             db.add(role_obj)
-            db.commit()
-            db.refresh(role_obj)
+            await db.commit()
+            await db.refresh(role_obj)
         new_user = User(
             username=username,
             password_hash=hashed,
@@ -48,7 +50,8 @@ async def register_password(update: Update, context: ContextTypes.DEFAULT_TYPE)
             telegram_id=update.effective_user.id
         )
         db.add(new_user)
-        db.commit()
+        await db.commit()
+    identity_cache.invalidate(update.effective_user.id)
 
     await update.message.reply_text(
         f"✅ Зарегистрированы как <code>{username}</code>, роль: client.", parse_mode="HTML"
@@ -64,8 +67,8 @@ async def login_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def login_username(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     username = update.message.text.strip()
     context.user_data["login_username"] = username
-    with get_db() as db:
-        if not db.query(User).filter(User.username == username).first():
+    async with get_async_db() as db:
+        if not await db.scalar(select(User.id).where(User.username == username)):
             await update.message.reply_text("Пользователь не найден.")
             return ConversationHandler.END
     await update.message.reply_text("Введите пароль:")
@@ -75,18 +78,29 @@ async def login_username(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def login_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     password = update.message.text.strip()
     username = context.user_data["login_username"]
-    with get_db() as db:
-        user_obj = db.query(User).filter(User.username == username).first()
-        if user_obj and bcrypt.checkpw(password.encode(), user_obj.password_hash.encode()):
+    async with get_async_db() as db:
+        row = (
+            await db.execute(select(User, Role.name).join(Role, Role.id == User.role_id).where(User.username == username))
+        ).first()
+        user_obj, role_name = row if row else (None, None)
+        if user_obj and await password_hasher.verify(password, user_obj.password_hash):
+            changed = False
             if user_obj.telegram_id is None:
                 user_obj.telegram_id = update.effective_user.id
+                changed = True
+            # пароль известен только сейчас: заодно поднимаем стоимость устаревшего хеша
+            if password_hasher.needs_rehash(user_obj.password_hash):
+                user_obj.password_hash = await password_hasher.hash(password)
+                changed = True
+            if changed:
                 db.add(user_obj)
-                db.commit()
+                await db.commit()
+            identity_cache.invalidate(update.effective_user.id)
             context.user_data["is_authenticated"] = True
             context.user_data.update({
                 "user_id": user_obj.id,
                 "username": user_obj.username,
-                "role": db.query(Role).filter(Role.id == user_obj.role_id).first().name
+                "role": role_name
             })
             await update.message.reply_text(
                 f"✅ Вы вошли как <code>{username}</code>. Роль: <b>{context.user_data['role']}</b>.",
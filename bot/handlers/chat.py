@@ -1,35 +1,139 @@
 # bot/handlers/chat.py
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from telegram import Update
+import asyncio
+import os
+from telegram import Update, Message
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 from bot.handlers.utils import log_activity
+from bot.limits import rate_limited
+from bot.dialogue import Dialogue, DialogueStore
+from bot.faq import FaqIndex
+from bot.inference import InferenceEngine, InferenceBusy
+from bot.metrics import inference_stage
+from bot.response_cache import response_cache
 
-model: AutoModelForCausalLM = None
-tokenizer: AutoTokenizer = None
-device: torch.device = None
+# потоковый режим: ответ появляется в сообщении по мере генерации
+CHAT_STREAMING = os.getenv("CHAT_STREAMING", "0") == "1"
+# Telegram ограничивает частоту правок сообщения, чаще раза в секунду редактировать не стоит
+STREAM_EDIT_INTERVAL_S = float(os.getenv("CHAT_STREAM_EDIT_INTERVAL_S", "1.0"))
+# продолжение кэшируется, пока история не длиннее стольких обменов репликами: дальше совпадения редки
+RESPONSE_CACHE_MAX_CONTEXT_TURNS = int(os.getenv("RESPONSE_CACHE_MAX_CONTEXT_TURNS", "2"))
+BUSY_TEXT = "⏳ Сейчас много запросов, попробуйте чуть позже."
 
+engine: InferenceEngine = None
+faq_index: FaqIndex = None
+dialogues: DialogueStore = None
+
+async def _edit(message: Message, text: str, final: bool = False) -> bool:
+    try:
+        await message.edit_text(text)
+    except RetryAfter as e:
+        if not final:
+            return False
+        await asyncio.sleep(e.retry_after)
+        await message.edit_text(text)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    return True
+
+async def _reply_streaming(update: Update, chunks) -> str | None:
+    placeholder = await update.message.reply_text("…")
+    loop = asyncio.get_running_loop()
+    # первый фрагмент показывается сразу, интервал выдерживается только между последующими правками
+    text, shown, last_edit = "", "", float("-inf")
+    try:
+        async for chunk in chunks:
+            text += chunk
+            current = text.strip()
+            if current and current != shown and loop.time() - last_edit >= STREAM_EDIT_INTERVAL_S:
+                if await _edit(placeholder, current):
+                    shown = current
+                last_edit = loop.time()
+    except InferenceBusy:
+        await _edit(placeholder, BUSY_TEXT, final=True)
+        return None
+    final_text = text.strip() or "…"
+    if final_text != shown:
+        await _edit(placeholder, final_text, final=True)
+    return text.strip()
+
+async def _answer_first_turn(update: Update, user_text: str, prompt: str) -> str | None:
+    # без истории ответ зависит только от вопроса: годится кэш ответов и общий батч
+    cached = await response_cache.get(user_text)
+    if cached is not None:
+        await update.message.reply_text(cached)
+        return cached
+    if CHAT_STREAMING:
+        bot_answer = await _reply_streaming(update, engine.stream(prompt))
+    else:
+        try:
+            bot_answer = await engine.generate(prompt)
+        except InferenceBusy:
+            await update.message.reply_text(BUSY_TEXT)
+            return None
+        await update.message.reply_text(bot_answer)
+    if bot_answer:
+        await response_cache.put(user_text, bot_answer)
+    return bot_answer
+
+async def _answer_follow_up(update: Update, dialogue: Dialogue, user_text: str, user_ids) -> None:
+    # короткая история входит в ключ кэша отпечатком своих токенов
+    context = dialogue.context_key() if len(dialogue.turns) <= 2 * RESPONSE_CACHE_MAX_CONTEXT_TURNS else None
+    if context is not None:
+        cached = await response_cache.get(user_text, context=context)
+        if cached is not None:
+            await update.message.reply_text(cached)
+            # past_key_values прошлого хода остаётся у чата: его префикс по-прежнему верен
+            dialogue.add(user_ids, dialogue.bot_turn(cached))
+            return
+    turn = dialogue.continuation(user_ids)
+    if CHAT_STREAMING:
+        bot_answer = await _reply_streaming(update, engine.stream_turn(turn))
+    else:
+        try:
+            bot_answer = await engine.generate_turn(turn)
+        except InferenceBusy:
+            await update.message.reply_text(BUSY_TEXT)
+            return
+        await update.message.reply_text(bot_answer)
+    if bot_answer is not None:
+        dialogue.add(user_ids, dialogue.answer_turn(turn.answer_ids), kv=turn.kv)
+        if context is not None and bot_answer:
+            await response_cache.put(user_text, bot_answer, context=context)
+
+@rate_limited("llm")
 @log_activity("chat")
 async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    global model, tokenizer, device
-    if not model or not tokenizer or not device:
+    user_text = update.message.text.strip()
+    dialogue = dialogues.get(update.effective_chat.id) if dialogues is not None else None
+    # вопрос из FAQ: отвечаем сохранённым ответом без генерации
+    if faq_index:
+        match = faq_index.match(user_text)
+        if match:
+            context.intent_label = match.intent
+            await update.message.reply_text(match.answer)
+            if dialogue is not None:
+                dialogue.add(dialogue.user_turn(user_text), dialogue.bot_turn(match.answer))
+            return
+
+    if not engine or dialogue is None:
         await update.message.reply_text("Модель ещё не загружена, попробуйте позже.")
         return
 
-    user_text = update.message.text.strip()
-    prompt = f"<User>: {user_text}\n<Bot>:"
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=256)
-    input_ids = inputs.input_ids.to(device)
-    attention_mask = inputs.attention_mask.to(device)
-
-    output_ids = model.generate(
-        input_ids=input_ids,
-        attention_mask=attention_mask,
-        max_new_tokens=128,
-        pad_token_id=tokenizer.eos_token_id,
-        do_sample=False,
-        num_beams=1,
-    )
-    decoded = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-    bot_answer = decoded.split("<Bot>:")[-1].strip()
-    await update.message.reply_text(bot_answer)
+    # сообщения одного чата обрабатываются по очереди: каждое продолжает историю предыдущего
+    async with dialogue.lock:
+        # реплика токенизируется один раз здесь, генерация продолжения получает готовые id
+        with inference_stage.time(mode="dialogue", stage="tokenize"):
+            user_ids = dialogue.user_turn(user_text)
+        if dialogue.turns:
+            await _answer_follow_up(update, dialogue, user_text, user_ids)
+            return
+        bot_answer = await _answer_first_turn(update, user_text, dialogue.prompt(user_ids))
+        if bot_answer:
+            dialogue.add(user_ids, dialogue.bot_turn(bot_answer))
+
+async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if dialogues is not None:
+        dialogues.reset(update.effective_chat.id)
+    await update.message.reply_text("Контекст диалога очищен.")
@@ -1,12 +1,14 @@
 # bot/handlers/dashboard.py
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
-from sqlalchemy import func
-from db.database import get_db
+from sqlalchemy import func, select
+from db.database import get_async_db
 from db.models import User, File, UserActivity, Role
 from bot.handlers.utils import log_activity
+from bot.limits import rate_limited
 from bot.handlers.auth_utils import requires_role
 
+@rate_limited("db")
 @log_activity("dashboard")
 @requires_role(["admin", "manager", "client"])
 async def dashboard_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -15,11 +17,12 @@ async def dashboard_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Пожалуйста, войдите через /login.")
         return
 
-    with get_db() as db:
-        user_obj = db.query(User).filter(User.id == user_id).first()
-        role_name = db.query(Role).filter(Role.id == user_obj.role_id).first().name
-        files_count = db.query(func.count(File.id)).filter(File.user_id == user_obj.id).scalar() or 0
-        total_requests = db.query(func.count(UserActivity.id)).filter(UserActivity.user_id == user_obj.id).scalar() or 0
+    async with get_async_db() as db:
+        user_obj, role_name = (
+            await db.execute(select(User, Role.name).join(Role, Role.id == User.role_id).where(User.id == user_id))
+        ).one()
+        files_count = await db.scalar(select(func.count(File.id)).where(File.user_id == user_obj.id)) or 0
+        total_requests = await db.scalar(select(func.count(UserActivity.id)).where(UserActivity.user_id == user_obj.id)) or 0
 
     text = (
         f"<b>Кабинет</b>\n"
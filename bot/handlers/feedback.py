@@ -1,8 +1,8 @@
 # bot/handlers/feedback.py
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from db.database import get_db
-from db.models import User, UserFeedback
+from db.database import get_async_db
+from db.models import UserFeedback
 from bot.handlers.utils import log_activity
 
 @log_activity("request_feedback")
@@ -23,14 +23,13 @@ async def process_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await query.answer()
     rating = 1 if query.data == "like" else 0
     original = query.message.reply_to_message.text if query.message.reply_to_message else None
-    user_tid = query.from_user.id
+    identity = context.identity
+    if not identity:
+        return await query.answer("Сначала /start.", show_alert=True)
 
-    with get_db() as db:
-        db_user = db.query(User).filter(User.telegram_id == user_tid).first()
-        if not db_user:
-            return await query.answer("Сначала /start.", show_alert=True)
-        fb = UserFeedback(user_id=db_user.id, query_text=original, rating=rating)
+    async with get_async_db() as db:
+        fb = UserFeedback(user_id=identity.user_id, query_text=original, rating=rating)
         db.add(fb)
-        db.commit()
+        await db.commit()
 
     await query.edit_message_text("Спасибо за отзыв!")
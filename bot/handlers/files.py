@@ -1,13 +1,17 @@
 # bot/handlers/files.py
+import logging
 import os
 from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, ConversationHandler, filters, CallbackQueryHandler
-from db.database import get_db
-from db.models import User, File
+from sqlalchemy import delete as sql_delete, select, update as sql_update
+from db.database import get_async_db
+from db.models import File
 from bot.handlers.utils import log_activity
+from bot.storage import file_store
+
+logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 WAIT_FOR_FILE = range(1)[0]
 
 @log_activity("upload_start")
@@ -17,26 +21,22 @@ async def upload_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 @log_activity("receive_file")
 async def receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_tid = update.effective_user.id
     if not update.message.document:
         await update.message.reply_text("Пожалуйста, отправьте файл.")
         return WAIT_FOR_FILE
 
-    with get_db() as db:
-        db_user = db.query(User).filter(User.telegram_id == user_tid).first()
-        if not db_user:
-            await update.message.reply_text("Сначала зарегистрируйтесь.")
-            return ConversationHandler.END
-        doc = update.message.document
-        file_obj = await context.bot.get_file(doc.file_id)
-        path = os.path.join(UPLOAD_DIR, doc.file_name)
-        await file_obj.download_to_drive(path)
-
-        record = File(user_id=db_user.id, filename=doc.file_name, file_path=path)
-        db.add(record)
-        db.commit()
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь.")
+        return ConversationHandler.END
+    doc = update.message.document
+    filename = doc.file_name or doc.file_unique_id
+    file_obj = await context.bot.get_file(doc.file_id)
+    await file_store.add_telegram_file(
+        file_obj, File(user_id=identity.user_id, filename=filename, telegram_file_id=doc.file_id),
+    )
 
-    await update.message.reply_text(f"✅ Файл «{doc.file_name}» сохранён.")
+    await update.message.reply_text(f"✅ Файл «{filename}» сохранён.")
     return ConversationHandler.END
 
 @log_activity("cancel_upload")
@@ -46,34 +46,79 @@ async def cancel_upload(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 @log_activity("list_files")
 async def list_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_tid = update.effective_user.id
-    with get_db() as db:
-        db_user = db.query(User).filter(User.telegram_id == user_tid).first()
-        if not db_user:
-            await update.message.reply_text("Сначала зарегистрируйтесь.")
-            return
-        files = db.query(File).filter(File.user_id == db_user.id).all()
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь.")
+        return
+    async with get_async_db() as db:
+        files = (await db.scalars(select(File).where(File.user_id == identity.user_id))).all()
     if not files:
         await update.message.reply_text("Нет загруженных файлов.")
         return
 
-    keyboard = [[InlineKeyboardButton(f.filename, callback_data=f"download_{f.id}")] for f in files]
+    keyboard = [
+        [InlineKeyboardButton(f.filename, callback_data=f"download_{f.id}"), InlineKeyboardButton("🗑", callback_data=f"delete_{f.id}")]
+        for f in files
+    ]
     await update.message.reply_text("Ваши файлы:", reply_markup=InlineKeyboardMarkup(keyboard))
 
 @log_activity("download_file")
 async def download_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    uid = query.from_user.id
     fid = int(query.data.split("_", 1)[1])
-    with get_db() as db:
-        db_user = db.query(User).filter(User.telegram_id == uid).first()
-        record = db.query(File).filter(File.id == fid, File.user_id == db_user.id).first()
+    identity = context.identity
+    record = None
+    if identity:
+        async with get_async_db() as db:
+            record = await db.scalar(select(File).where(File.id == fid, File.user_id == identity.user_id))
+    if not record:
+        await query.edit_message_text("Файл не найден.")
+        return
+    chat_id = query.message.chat_id
+    # файл уже есть на серверах Telegram: отправляется только ссылка на него
+    if record.telegram_file_id:
+        try:
+            await context.bot.send_document(chat_id=chat_id, document=record.telegram_file_id)
+            return
+        except BadRequest as e:
+            logger.warning("file_id файла %s больше не действителен: %s", record.id, e)
+    with await file_store.open(record) as f:
+        message = await context.bot.send_document(chat_id=chat_id, document=InputFile(f, filename=record.filename))
+    async with get_async_db() as db:
+        await db.execute(sql_update(File).where(File.id == record.id).values(telegram_file_id=message.document.file_id))
+        await db.commit()
+
+@log_activity("delete_file")
+async def delete_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    fid = int(query.data.split("_", 1)[1])
+    identity = context.identity
+    record = None
+    if identity:
+        async with get_async_db() as db:
+            # DELETE сразу уходит в БД (сессии без autoflush): иначе files ещё ссылалась бы на blob,
+            # который release() удаляет, и внешний ключ отверг бы удаление
+            record = (await db.execute(
+                sql_delete(File).where(File.id == fid, File.user_id == identity.user_id)
+                .returning(File.filename, File.file_path, File.blob_sha256)
+            )).first()
+            if record and record.blob_sha256:
+                # release() коммитит удаление записи вместе со счётчиком ссылок
+                await file_store.release(db, record.blob_sha256)
+            else:
+                await db.commit()
     if not record:
         await query.edit_message_text("Файл не найден.")
         return
-    with open(record.file_path, "rb") as f:
-        await context.bot.send_document(chat_id=query.message.chat_id, document=InputFile(f, filename=record.filename))
+    if not record.blob_sha256:
+        # записи до перехода на blob'ы: файл на диске принадлежит только этой записи
+        try:
+            os.unlink(record.file_path)
+        except FileNotFoundError:
+            pass
+    await query.edit_message_text(f"🗑 Файл «{record.filename}» удалён.")
 
 upload_handler = ConversationHandler(
     entry_points=[CommandHandler("upload", upload_start)],
@@ -83,3 +128,4 @@ upload_handler = ConversationHandler(
 )
 list_files_handler = CommandHandler("list_files", list_files)
 download_file_handler = CallbackQueryHandler(download_file, pattern="^download_\\d+$")
+delete_file_handler = CallbackQueryHandler(delete_file, pattern="^delete_\\d+$")
@@ -0,0 +1,114 @@
+# bot/handlers/flashcards.py
+from datetime import datetime, timezone
+from html import escape
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from db.database import get_async_db
+from db.models import Flashcard
+from bot.flashcards import CardState, card_counts, due_cards, review_log, sm2
+from bot.handlers.utils import log_activity
+
+# оценки SM-2 за кнопками: не вспомнил, с трудом, хорошо, легко
+GRADES = [("🔁 Снова", 1), ("😓 Трудно", 3), ("🙂 Хорошо", 4), ("😎 Легко", 5)]
+
+def _snapshot(card: Flashcard) -> dict:
+    return {
+        "id": card.id, "question": card.question, "answer": card.answer,
+        "ease": card.ease, "interval_days": card.interval_days, "repetitions": card.repetitions,
+    }
+
+def _question_view(card: dict, left: int):
+    keyboard = [[InlineKeyboardButton("👀 Показать ответ", callback_data="fc:show")]]
+    text = f"🃏 <b>{escape(card['question'])}</b>\n\n<i>Осталось в сессии: {left}</i>"
+    return text, InlineKeyboardMarkup(keyboard)
+
+def _answer_view(card: dict):
+    keyboard = [[InlineKeyboardButton(label, callback_data=f"fc:grade:{card['id']}:{q}") for label, q in GRADES]]
+    text = f"🃏 <b>{escape(card['question'])}</b>\n\n{escape(card['answer'])}"
+    return text, InlineKeyboardMarkup(keyboard)
+
+@log_activity("add_card")
+async def add_card_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь.")
+        return
+    question, sep, answer = " ".join(context.args).partition("|")
+    if not sep or not question.strip() or not answer.strip():
+        await update.message.reply_text("Формат: /add_card вопрос | ответ")
+        return
+    async with get_async_db() as db:
+        db.add(Flashcard(
+            user_id=identity.user_id, question=question.strip(), answer=answer.strip(),
+            due_at=datetime.now(timezone.utc),
+        ))
+        await db.commit()
+    await update.message.reply_text("✅ Карточка добавлена. Повторение: /review")
+
+@log_activity("cards")
+async def cards_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь.")
+        return
+    total, due = await card_counts(identity.user_id)
+    await update.message.reply_text(f"Карточек: {total}, к повторению сейчас: {due}.")
+
+@log_activity("review")
+async def review_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь.")
+        return
+    # очередь сессии живёт в памяти user_data и в БД не сохраняется (см. SESSION_KEYS)
+    queue = [_snapshot(card) for card in await due_cards(identity.user_id)]
+    context.user_data["flashcards"] = {"queue": queue, "reviewed": 0}
+    if not queue:
+        await update.message.reply_text("Нет карточек к повторению 🎉")
+        return
+    text, markup = _question_view(queue[0], len(queue))
+    await update.message.reply_html(text, reply_markup=markup)
+
+@log_activity("review_callback")
+async def review_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    identity = context.identity
+    session = context.user_data.get("flashcards")
+    if not identity or not session or not session["queue"]:
+        await query.edit_message_text("Сессия повторения закончилась. Начать заново: /review")
+        return
+    queue = session["queue"]
+    card = queue[0]
+    if query.data == "fc:show":
+        text, markup = _answer_view(card)
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+        return
+
+    _, _, card_id, quality = query.data.split(":")
+    # повторное нажатие на кнопку уже оценённой карточки
+    if int(card_id) != card["id"]:
+        return
+    quality = int(quality)
+    now = datetime.now(timezone.utc)
+    # карточку могли уже оценить в этой сессии («Снова»), а новое состояние ещё не записано в БД
+    pending = review_log.pending_state(card["id"])
+    current = pending or card
+    state: CardState = sm2(current["ease"], current["interval_days"], current["repetitions"], quality, now)
+    review_log.record(card["id"], identity.user_id, quality, state, now)
+    session["reviewed"] += 1
+    queue.pop(0)
+
+    if not queue:
+        # в очередь возвращаются и карточки «Снова», у которых уже подошёл срок
+        queue.extend(_snapshot(c) for c in await due_cards(identity.user_id))
+    if not queue:
+        await query.edit_message_text(f"✅ Повторено карточек: {session['reviewed']}. Следующие — позже.")
+        return
+    text, markup = _question_view(queue[0], len(queue))
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+
+add_card_handler = CommandHandler("add_card", add_card_command)
+cards_handler = CommandHandler("cards", cards_command)
+review_handler = CommandHandler("review", review_command)
+review_callback_handler = CallbackQueryHandler(review_callback, pattern=r"^fc:")
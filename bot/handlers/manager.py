@@ -1,12 +1,14 @@
 # bot/handlers/manager.py
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
-from sqlalchemy import func
-from db.database import get_db
+from sqlalchemy import func, select
+from db.database import get_async_db
 from db.models import User, File, Role
 from bot.handlers.auth_utils import requires_role
 from bot.handlers.utils import log_activity
+from bot.limits import rate_limited
 
+@rate_limited("db")
 @log_activity("manager_panel")
 @requires_role(["admin", "manager"])
 async def manager_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -16,6 +18,7 @@ async def manager_panel_handler(update: Update, context: ContextTypes.DEFAULT_TY
     ]
     await update.message.reply_text("Панель менеджера:", reply_markup=InlineKeyboardMarkup(keyboard))
 
+@rate_limited("db")
 @log_activity("manager_callback")
 @requires_role(["admin", "manager"])
 async def manager_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -23,22 +26,23 @@ async def manager_callback_handler(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     data = query.data
 
-    with get_db() as db:
-        role_client = db.query(Role).filter(Role.name == "client").first()
+    async with get_async_db() as db:
+        role_client = await db.scalar(select(Role).where(Role.name == "client"))
         if not role_client:
             return await query.edit_message_text("Роль client не найдена.")
         if data == "mgr_list_clients":
-            clients = db.query(User).filter(User.role_id == role_client.id).all()
+            clients = (await db.scalars(select(User).where(User.role_id == role_client.id))).all()
             text = "<b>Клиенты:</b>\n" + "\n".join(f"– {c.username}" for c in clients)
             await query.edit_message_text(text, parse_mode="HTML")
         elif data == "mgr_list_files":
             rows = (
-                db.query(User.username, func.count(File.id).label("cnt"))
-                  .outerjoin(File, User.id == File.user_id)
-                  .filter(User.role_id == role_client.id)
-                  .group_by(User.username)
-                  .all()
-            )
+                await db.execute(
+                    select(User.username, func.count(File.id).label("cnt"))
+                    .outerjoin(File, User.id == File.user_id)
+                    .where(User.role_id == role_client.id)
+                    .group_by(User.username)
+                )
+            ).all()
             text = "<b>Файлы клиентов:</b>\n" + "\n".join(f"– {u}: {cnt}" for u, cnt in rows)
             await query.edit_message_text(text, parse_mode="HTML")
         else:
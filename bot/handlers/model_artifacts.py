@@ -1,26 +1,89 @@
 # bot/handlers/model_artifacts.py
+import asyncio
+import logging
+import os
 import tempfile
 from telegram import Update, InputFile
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CommandHandler
-from huggingface_hub import hf_hub_download
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.database import get_async_db
+from db.models import TelegramArtifact
 from bot.handlers.auth_utils import requires_role
 from bot.handlers.utils import log_activity
+from bot.limits import rate_limited
+from bot.model_loader import HUB_REPO_ID, read_snapshot_meta
 
-HUB_REPO_ID = "Dilshodbek11/ruDialoGPT-finetuned"
+logger = logging.getLogger(__name__)
 
+ARTIFACTS = ["pytorch_model.bin", "config.json", "tokenizer.json"]
+
+async def _hub_revision() -> str:
+    # бот работает с закреплённой ревизией локального снимка; без снимка берётся текущая ревизия хаба
+    meta = read_snapshot_meta()
+    if meta and meta.get("repo") == HUB_REPO_ID:
+        return meta["revision"]
+    from huggingface_hub import HfApi
+    info = await asyncio.to_thread(HfApi().model_info, HUB_REPO_ID, token=os.getenv("HUGGINGFACE_TOKEN"))
+    return info.sha
+
+async def _cached_file_ids(revision: str) -> dict[str, str]:
+    async with get_async_db() as db:
+        rows = await db.execute(
+            select(TelegramArtifact.filename, TelegramArtifact.file_id)
+            .where(TelegramArtifact.repo_id == HUB_REPO_ID, TelegramArtifact.revision == revision)
+        )
+        return dict(rows.all())
+
+async def _remember_file_id(revision: str, filename: str, file_id: str) -> None:
+    async with get_async_db() as db:
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(TelegramArtifact).values(repo_id=HUB_REPO_ID, revision=revision, filename=filename, file_id=file_id)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[TelegramArtifact.repo_id, TelegramArtifact.revision, TelegramArtifact.filename],
+            set_={"file_id": file_id},
+        ))
+        await db.commit()
+
+@rate_limited("db")
 @log_activity("download_model")
 @requires_role(["admin", "manager"])
 async def download_model_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("Загрузка артефактов модели…")
-    files = ["pytorch_model.bin", "config.json", "tokenizer.json"]
-    for name in files:
-        try:
-            tmp = tempfile.mkdtemp()
-            path = hf_hub_download(repo_id=HUB_REPO_ID, filename=name, local_dir=tmp)
-            with open(path, "rb") as f:
-                await context.bot.send_document(chat_id=update.effective_chat.id, document=InputFile(f, filename=name))
-        except Exception as e:
-            await update.message.reply_text(f"Ошибка {name}: {e}")
+    chat_id = update.effective_chat.id
+    try:
+        revision = await _hub_revision()
+    except Exception as e:
+        await update.message.reply_text(f"Не удалось определить ревизию модели: {e}")
+        return
+    file_ids = await _cached_file_ids(revision)
+    # временный каталог удаляется целиком по выходу, даже если отправка упала
+    with tempfile.TemporaryDirectory(prefix="artifacts-") as tmp:
+        for name in ARTIFACTS:
+            try:
+                # уже отправленный артефакт этой ревизии: только ссылка, без повторной загрузки сотен МБ
+                if name in file_ids:
+                    try:
+                        await context.bot.send_document(chat_id=chat_id, document=file_ids[name])
+                        continue
+                    except BadRequest as e:
+                        logger.warning("file_id артефакта %s@%s больше не действителен: %s", name, revision, e)
+                from huggingface_hub import hf_hub_download
+                path = await asyncio.to_thread(
+                    hf_hub_download, repo_id=HUB_REPO_ID, filename=name, revision=revision, local_dir=tmp,
+                    token=os.getenv("HUGGINGFACE_TOKEN"),
+                )
+                try:
+                    with open(path, "rb") as f:
+                        message = await context.bot.send_document(chat_id=chat_id, document=InputFile(f, filename=name))
+                finally:
+                    # следующий артефакт не должен ждать места на диске рядом с этим
+                    os.unlink(path)
+                await _remember_file_id(revision, name, message.document.file_id)
+            except Exception as e:
+                await update.message.reply_text(f"Ошибка {name}: {e}")
     await update.message.reply_text("Готово.")
 
 download_model_handler = CommandHandler("download_model", download_model_handler)
@@ -1,7 +1,8 @@
 # bot/handlers/settings.py
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
-from db.database import get_db
+from sqlalchemy import select
+from db.database import get_async_db
 from db.models import UserSetting
 from bot.handlers.utils import log_activity
 
@@ -12,13 +13,13 @@ CHOICES_MARKUP = ReplyKeyboardMarkup([["1", CANCEL]], one_time_keyboard=True, re
 @log_activity("settings_start")
 async def start_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_tid = update.effective_user.id
-    with get_db() as db:
-        setting = db.query(UserSetting).filter(UserSetting.user_id == user_tid).first()
+    async with get_async_db() as db:
+        setting = await db.scalar(select(UserSetting).where(UserSetting.user_id == user_tid))
         if not setting:
             setting = UserSetting(user_id=user_tid)
             db.add(setting)
-            db.commit()
-            db.refresh(setting)
+            await db.commit()
+            await db.refresh(setting)
     text = (
         f"<b>Текущая длина суммаризации:</b> {setting.default_summary_length}\n"
         "1 – Изменить длину\n"
@@ -47,11 +48,11 @@ async def set_summary_length(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Введите число от 1 до 20:")
         return TYPING_SUMMARY_LENGTH
     new_len = int(text)
-    with get_db() as db:
-        setting = db.query(UserSetting).filter(UserSetting.user_id == user_tid).first()
+    async with get_async_db() as db:
+        setting = await db.scalar(select(UserSetting).where(UserSetting.user_id == user_tid))
         setting.default_summary_length = new_len
         db.add(setting)
-        db.commit()
+        await db.commit()
     await update.message.reply_text(f"Длина суммаризации: {new_len}", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
@@ -1,31 +1,43 @@
 # bot/handlers/stats.py
 import io
-import matplotlib.pyplot as plt
 from telegram import Update, InputFile
 from telegram.ext import ContextTypes
-from sqlalchemy import func
-from db.database import get_db
-from db.models import User, UserActivity
+from sqlalchemy import func, select
+from db.database import get_async_db
+from db.models import User, UserActivity, ActivityRollup
+from bot.rollups import ALL_USERS, ALL_HANDLERS, TOTAL_BUCKET
+from bot.charts import chart_service
 from bot.handlers.utils import log_activity
+from bot.limits import rate_limited
 from bot.handlers.auth_utils import requires_role
 
 @log_activity("stats_user")
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_tid = update.effective_user.id
-    with get_db() as db:
-        db_user = db.query(User).filter(User.telegram_id == user_tid).first()
-        if not db_user:
-            await update.message.reply_text("Сначала зарегистрируйтесь через /start.")
-            return
-        total_requests = db.query(func.count(UserActivity.id)).filter(UserActivity.user_id == db_user.id).scalar() or 0
-        avg_time = db.query(func.avg(UserActivity.response_time_ms)).filter(UserActivity.user_id == db_user.id).scalar() or 0
+    identity = context.identity
+    if not identity:
+        await update.message.reply_text("Сначала зарегистрируйтесь через /start.")
+        return
+    async with get_async_db() as db:
+        totals = (
+            await db.execute(
+                select(ActivityRollup.request_count, ActivityRollup.response_time_sum_ms).where(
+                    ActivityRollup.granularity == "total",
+                    ActivityRollup.bucket_start == TOTAL_BUCKET,
+                    ActivityRollup.user_id == identity.user_id,
+                    ActivityRollup.handler_name == ALL_HANDLERS,
+                )
+            )
+        ).first()
+        total_requests, time_sum = totals or (0, 0)
+        avg_time = time_sum / total_requests if total_requests else 0
         last_5 = (
-            db.query(UserActivity)
-            .filter(UserActivity.user_id == db_user.id)
-            .order_by(UserActivity.timestamp.desc())
-            .limit(5)
-            .all()
-        )
+            await db.scalars(
+                select(UserActivity)
+                .where(UserActivity.user_id == identity.user_id)
+                .order_by(UserActivity.timestamp.desc())
+                .limit(5)
+            )
+        ).all()
 
     text = (
         f"<b>Ваша статистика:</b>\n"
@@ -40,26 +52,33 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_html(text)
 
+@rate_limited("db")
 @log_activity("stats_global")
 @requires_role(["admin"])
 async def stats_global_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_tid = update.effective_user.id
-    with get_db() as db:
+    handler_totals = select(ActivityRollup).where(
+        ActivityRollup.granularity == "total",
+        ActivityRollup.bucket_start == TOTAL_BUCKET,
+        ActivityRollup.user_id == ALL_USERS,
+        ActivityRollup.handler_name != ALL_HANDLERS,
+    )
+    avg_rt = ActivityRollup.response_time_sum_ms / ActivityRollup.request_count
+    async with get_async_db() as db:
         top_handlers = (
-            db.query(UserActivity.handler_name, func.count(UserActivity.id).label("cnt"))
-            .group_by(UserActivity.handler_name)
-            .order_by(func.count(UserActivity.id).desc())
-            .limit(5)
-            .all()
-        )
+            await db.execute(
+                handler_totals.with_only_columns(ActivityRollup.handler_name, ActivityRollup.request_count)
+                .order_by(ActivityRollup.request_count.desc())
+                .limit(5)
+            )
+        ).all()
         slow_handlers = (
-            db.query(UserActivity.handler_name, func.avg(UserActivity.response_time_ms).label("avg_rt"))
-            .group_by(UserActivity.handler_name)
-            .order_by(func.avg(UserActivity.response_time_ms).desc())
-            .limit(5)
-            .all()
-        )
-        total_users = db.query(func.count(User.id)).scalar() or 0
+            await db.execute(
+                handler_totals.with_only_columns(ActivityRollup.handler_name, avg_rt.label("avg_rt"))
+                .order_by(avg_rt.desc())
+                .limit(5)
+            )
+        ).all()
+        total_users = await db.scalar(select(func.count(User.id))) or 0
 
     text = (
         f"<b>Общая статистика по боту:</b>\n"
@@ -74,29 +93,28 @@ async def stats_global_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
     await update.message.reply_html(text)
 
-    with get_db() as db:
+    async with get_async_db() as db:
         dates_counts = (
-            db.query(func.date(UserActivity.timestamp).label("day"), func.count(UserActivity.id).label("cnt"))
-            .group_by(func.date(UserActivity.timestamp))
-            .order_by(func.date(UserActivity.timestamp))
-            .all()
-        )
+            await db.execute(
+                select(ActivityRollup.bucket_start.label("day"), ActivityRollup.request_count.label("cnt"))
+                .where(
+                    ActivityRollup.granularity == "day",
+                    ActivityRollup.user_id == ALL_USERS,
+                    ActivityRollup.handler_name == ALL_HANDLERS,
+                )
+                .order_by(ActivityRollup.bucket_start)
+            )
+        ).all()
     if dates_counts:
-        days = [str(r.day) for r in dates_counts]
+        days = [r.day.date().isoformat() for r in dates_counts]
         counts = [r.cnt for r in dates_counts]
-        plt.figure(figsize=(6,4))
-        plt.plot(days, counts, marker="o")
-        plt.xticks(rotation=45, ha="right")
-        plt.title("Запросы по дням")
-        plt.xlabel("Дата")
-        plt.ylabel("Количество запросов")
-        plt.tight_layout()
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        buf.seek(0)
-        plt.close()
-        await context.bot.send_photo(
+        chart = await chart_service.requests_by_day(days, counts)
+        # тот же график уже отправлялся: достаточно сослаться на file_id, байты не загружаются повторно
+        photo = chart.file_id or InputFile(io.BytesIO(chart.png), filename="requests_by_day.png")
+        sent = await context.bot.send_photo(
             chat_id=update.effective_chat.id,
-            photo=InputFile(buf, filename="requests_by_day.png"),
+            photo=photo,
             caption="График запросов по дням"
         )
+        if sent and sent.photo:
+            chart_service.remember_file_id(chart.key, sent.photo[-1].file_id)
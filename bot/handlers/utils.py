@@ -1,46 +1,41 @@
 # bot/handlers/utils.py
 import time
+from datetime import datetime, timezone
 from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
-from db.database import get_db
-from db.models import User, UserActivity
+from bot.activity import activity_sink
+from bot.identity import get_identity
+from bot.metrics import handler_errors, handler_latency
 
 def log_activity(handler_name: str):
     def decorator(func):
         @wraps(func)
         async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-            user_id_telegram = update.effective_user.id if update.effective_user else None
+            identity = await get_identity(update, context)
             query_text = (
                 update.callback_query.data
                 if update.callback_query
                 else (update.message.text if update.message else None)
             )
-            start_ts = time.time()
-            activity = None
-
-            if user_id_telegram:
-                with get_db() as db:
-                    user = db.query(User).filter(User.telegram_id == user_id_telegram).first()
-                    if user:
-                        activity = UserActivity(
-                            user_id=user.id,
-                            query_text=query_text,
-                            handler_name=handler_name
-                        )
-                        db.add(activity)
-                        db.commit()
-                        db.refresh(activity)
-
-            result = await func(update, context, *args, **kwargs)
-
-            if activity:
-                elapsed = int((time.time() - start_ts) * 1000)
-                with get_db() as db:
-                    activity.response_time_ms = elapsed
-                    db.add(activity)
-                    db.commit()
-
-            return result
+            started_at = datetime.now(timezone.utc)
+            start_ts = time.perf_counter()
+            try:
+                return await func(update, context, *args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler=handler_name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start_ts
+                handler_latency.observe(elapsed, handler=handler_name)
+                if identity:
+                    activity_sink.record(
+                        user_id=identity.user_id,
+                        timestamp=started_at,
+                        query_text=query_text,
+                        intent_label=context.__dict__.get("intent_label"),
+                        handler_name=handler_name,
+                        response_time_ms=int(elapsed * 1000),
+                    )
         return wrapper
     return decorator
@@ -0,0 +1,69 @@
+# bot/identity.py
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from sqlalchemy import select
+from db.database import get_async_db
+from db.models import User, Role
+
+IDENTITY_CACHE_TTL_S = float(os.getenv("IDENTITY_CACHE_TTL_S", "300"))
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+
+class Identity(NamedTuple):
+    user_id: int
+    role: str
+
+_MISSING = object()
+
+# telegram_id → Identity (или None для незарегистрированных), с TTL и вытеснением по LRU
+class IdentityCache:
+    def __init__(self, ttl_s: float = IDENTITY_CACHE_TTL_S, max_size: int = IDENTITY_CACHE_SIZE):
+        self.ttl = ttl_s
+        self.max_size = max_size
+        self._entries: OrderedDict[int, tuple[float, Identity | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int):
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(telegram_id, None)
+            self.misses += 1
+            return _MISSING
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, telegram_id: int, identity: Identity | None) -> None:
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, identity)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: int | None) -> None:
+        if telegram_id is not None:
+            self._entries.pop(telegram_id, None)
+
+identity_cache = IdentityCache()
+
+async def resolve_identity(telegram_id: int) -> Identity | None:
+    identity = identity_cache.get(telegram_id)
+    if identity is not _MISSING:
+        return identity
+    async with get_async_db() as db:
+        row = (
+            await db.execute(
+                select(User.id, Role.name).join(Role, Role.id == User.role_id).where(User.telegram_id == telegram_id)
+            )
+        ).first()
+    identity = Identity(*row) if row else None
+    identity_cache.put(telegram_id, identity)
+    return identity
+
+# один поиск на апдейт: результат кладётся в context.identity и переиспользуется вложенными хендлерами
+async def get_identity(update, context) -> Identity | None:
+    if "identity" not in context.__dict__:
+        tg_user = update.effective_user
+        context.identity = await resolve_identity(tg_user.id) if tg_user else None
+    return context.identity
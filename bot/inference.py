@@ -0,0 +1,343 @@
+# bot/inference.py
+import asyncio
+import logging
+import os
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from bot.dialogue import Continuation, KvCache
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW_MS = int(os.getenv("INFERENCE_BATCH_WINDOW_MS", "30"))
+BATCH_MAX_SIZE = int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "8"))
+WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+TORCH_THREADS = int(os.getenv("INFERENCE_TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // WORKERS)
+QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "60"))
+MAX_INPUT_LENGTH = 256
+MAX_NEW_TOKENS = 128
+
+class InferenceBusy(Exception):
+    pass
+
+class InferenceTimeout(InferenceBusy):
+    pass
+
+# torch и transformers импортируются при первом использовании, чтобы не замедлять запуск бота
+@lru_cache(maxsize=None)
+def _streaming_classes():
+    import torch
+    from transformers import StoppingCriteria, TextStreamer
+
+    # Передаёт готовые куски текста из потока генерации в asyncio-очередь
+    class AsyncTextStreamer(TextStreamer):
+        def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, chunks: asyncio.Queue):
+            super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+            self.loop = loop
+            self.chunks = chunks
+            self.cancelled = False
+            self.generated_tokens = 0
+
+        def put(self, value):
+            # первый вызов — промпт, его skip_prompt отбрасывает
+            if not self.next_tokens_are_prompt:
+                self.generated_tokens += value.numel()
+            super().put(value)
+
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if text:
+                self.loop.call_soon_threadsafe(self.chunks.put_nowait, text)
+
+    # Останавливает генерацию, когда результат больше никому не нужен: читатель потока ушёл
+    # или все ожидающие батча отменили ожидание по таймауту
+    class StopWhen(StoppingCriteria):
+        def __init__(self, predicate):
+            self.predicate = predicate
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), self.predicate(), dtype=torch.bool, device=input_ids.device)
+
+    return AsyncTextStreamer, StopWhen
+
+_STREAM_END = object()
+
+def _common_prefix(a: array, b: array) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+# Собирает промпты в батчи и выполняет один model.generate на батч вне event loop
+class InferenceEngine:
+    def __init__(
+        self, model, tokenizer, device,
+        window_ms: int = BATCH_WINDOW_MS, max_batch_size: int = BATCH_MAX_SIZE,
+        workers: int = WORKERS, torch_threads: int = TORCH_THREADS,
+        queue_size: int = QUEUE_SIZE, timeout_s: float = REQUEST_TIMEOUT_S,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.workers = workers
+        self.timeout = timeout_s
+        # для decoder-only модели паддинг слева, чтобы все промпты заканчивались на одной позиции
+        self.tokenizer.padding_side = "left"
+        # intra-op потоки делятся между воркерами, иначе они конкурируют за одни и те же ядра
+        import torch
+        torch.set_num_threads(torch_threads)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._slots = asyncio.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._task: asyncio.Task | None = None
+        self._batches: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="inference-batcher")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._batches):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def generate(self, prompt: str) -> str:
+        return await self._submit(prompt)
+
+    # Продолжение диалога идёт через тот же батчер: в одиночку — с past_key_values чата,
+    # вместе с другими запросами — полным префиксом в общем батче
+    async def generate_turn(self, turn: Continuation) -> str:
+        return await self._submit(turn)
+
+    async def _submit(self, payload: str | Continuation) -> str:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((payload, future))
+        except asyncio.QueueFull:
+            raise InferenceBusy(f"очередь генерации заполнена ({self._queue.maxsize})")
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise InferenceTimeout(f"генерация не уложилась в {self.timeout} с")
+
+    # Потоковая генерация не батчится: занимает отдельный воркер и отдаёт текст по мере готовности
+    async def stream(self, prompt: str):
+        async for chunk in self._stream(self._generate_streaming, prompt):
+            yield chunk
+
+    async def stream_turn(self, turn: Continuation):
+        async for chunk in self._stream(self._generate_continuation, turn):
+            yield chunk
+
+    async def _acquire_slot(self) -> None:
+        if self._queue.full():
+            raise InferenceBusy(f"очередь генерации заполнена ({self._queue.maxsize})")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise InferenceTimeout(f"нет свободного воркера в течение {self.timeout} с")
+
+    async def _stream(self, generate, payload):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        await self._acquire_slot()
+        chunks: asyncio.Queue = asyncio.Queue()
+        streamer_cls, _ = _streaming_classes()
+        streamer = streamer_cls(self.tokenizer, loop, chunks)
+        job = loop.run_in_executor(self._executor, generate, payload, streamer)
+        job.add_done_callback(lambda _: self._slots.release())
+        job.add_done_callback(lambda _: chunks.put_nowait(_STREAM_END))
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    raise InferenceTimeout(f"генерация не уложилась в {self.timeout} с")
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+            # пробрасываем исключение из потока генерации, если оно было
+            await job
+        finally:
+            streamer.cancelled = True
+
+    async def _collect_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        # пока все воркеры заняты, запросы копятся в очереди и уходят следующим, более крупным батчем
+        await self._slots.acquire()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect_batch()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            # вызывающий мог уже отменить ожидание по таймауту
+            batch = [(p, f) for p, f in batch if not f.done()]
+            if not batch:
+                return
+            payloads = [p for p, _ in batch]
+            futures = [f for _, f in batch]
+            # все ожидающие ушли по таймауту — генерацию можно прервать
+            abandoned = lambda: all(f.done() for f in futures)
+            if len(payloads) == 1 and isinstance(payloads[0], Continuation):
+                job = lambda: [self._generate_continuation(payloads[0], abandoned=abandoned)]
+            else:
+                job = lambda: self._generate_batch(payloads, abandoned)
+            try:
+                answers = await loop.run_in_executor(self._executor, job)
+            except Exception as e:
+                logger.exception("Ошибка генерации для батча из %d запросов", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), answer in zip(batch, answers):
+                if not future.done():
+                    future.set_result(answer)
+        finally:
+            self._slots.release()
+
+    # В одном батче могут быть и первые ходы (текст), и продолжения диалогов (готовые токены);
+    # продолжения идут полным префиксом без past_key_values — кэши разной длины в батч не склеить
+    def _generate_batch(self, payloads: list, abandoned=None) -> list[str]:
+        import torch
+        from transformers import StoppingCriteriaList
+        metrics.inference_batch_size.observe(len(payloads))
+        prompts = [p for p in payloads if isinstance(p, str)]
+        with metrics.inference_stage.time(mode="batch", stage="tokenize"):
+            encoded = iter(
+                self.tokenizer(prompts, truncation=True, max_length=MAX_INPUT_LENGTH).input_ids if prompts else []
+            )
+            ids = [next(encoded) if isinstance(p, str) else p.input_ids.tolist() for p in payloads]
+            inputs = self.tokenizer.pad({"input_ids": ids}, padding=True, return_tensors="pt")
+        for turn in payloads:
+            if isinstance(turn, Continuation):
+                # кэш этого хода не собирается: следующий ход чата пересчитает префикс целиком
+                turn.kv = None
+        input_ids = inputs.input_ids.to(self.device)
+        kwargs = self._generation_kwargs()
+        if abandoned is not None:
+            _, stop_cls = _streaming_classes()
+            kwargs["stopping_criteria"] = StoppingCriteriaList([stop_cls(abandoned)])
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=inputs.attention_mask.to(self.device),
+                **kwargs,
+            )
+        new_tokens = output_ids[:, input_ids.shape[1]:]
+        # паддинг после eos не считается: это не сгенерированные токены
+        generated = int((new_tokens != self.tokenizer.eos_token_id).sum())
+        metrics.observe_generation("batch", time.perf_counter() - started, generated)
+        for turn, row in zip(payloads, new_tokens.tolist()):
+            if isinstance(turn, Continuation):
+                if self.tokenizer.eos_token_id in row:
+                    row = row[: row.index(self.tokenizer.eos_token_id)]
+                turn.answer_ids = array("I", row)
+        with metrics.inference_stage.time(mode="batch", stage="decode"):
+            decoded = self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+        return [text.split("<Bot>:")[-1].strip() for text in decoded]
+
+    def _generate_streaming(self, prompt: str, streamer) -> None:
+        import torch
+        from transformers import StoppingCriteriaList
+        _, stop_cls = _streaming_classes()
+        with metrics.inference_stage.time(mode="stream", stage="tokenize"):
+            inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=MAX_INPUT_LENGTH)
+        started = time.perf_counter()
+        with torch.inference_mode():
+            self.model.generate(
+                input_ids=inputs.input_ids.to(self.device),
+                attention_mask=inputs.attention_mask.to(self.device),
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([stop_cls(lambda: streamer.cancelled)]),
+                **self._generation_kwargs(),
+            )
+        # декодирование идёт внутри стримера по ходу генерации и входит в generate
+        metrics.observe_generation("stream", time.perf_counter() - started, streamer.generated_tokens)
+
+    # Кэш прошлого хода забирается из turn и изменяется на месте (crop, дописывание). Диалог отдал его
+    # при continuation(), поэтому таймаут или ошибка здесь не оставят чату наполовину обрезанный кэш:
+    # обратно он попадёт только через Dialogue.add после успешного ответа
+    def _generate_continuation(self, turn: Continuation, streamer=None, abandoned=None) -> str:
+        import torch
+        from transformers import StoppingCriteriaList
+        input_ids = turn.input_ids
+        kv, turn.kv = turn.kv, None
+        past = None
+        if kv is not None:
+            # переиспользуется общий префикс с прошлым ходом, хотя бы один токен модель должна увидеть заново
+            reused = min(_common_prefix(kv.token_ids, input_ids), len(input_ids) - 1)
+            if reused > 0:
+                past = kv.past
+                if past.get_seq_length() > reused:
+                    past.crop(reused - past.get_seq_length())
+        ids = torch.tensor([input_ids.tolist()], dtype=torch.long, device=self.device)
+        mode = "dialogue_stream" if streamer is not None else "dialogue"
+        kwargs = self._generation_kwargs()
+        _, stop_cls = _streaming_classes()
+        if streamer is not None:
+            kwargs.update(streamer=streamer, stopping_criteria=StoppingCriteriaList([stop_cls(lambda: streamer.cancelled)]))
+        elif abandoned is not None:
+            kwargs["stopping_criteria"] = StoppingCriteriaList([stop_cls(abandoned)])
+        started = time.perf_counter()
+        with torch.inference_mode():
+            output = self.model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                past_key_values=past,
+                use_cache=True,
+                return_dict_in_generate=True,
+                **kwargs,
+            )
+        sequence = output.sequences[0].tolist()
+        answer_ids = sequence[len(input_ids):]
+        if answer_ids and answer_ids[-1] == self.tokenizer.eos_token_id:
+            answer_ids.pop()
+        metrics.observe_generation(mode, time.perf_counter() - started, len(answer_ids))
+        cache = output.past_key_values
+        # последний сгенерированный токен в кэш не попадает: модель его ещё не видела на входе
+        turn.answer_ids = array("I", answer_ids)
+        turn.kv = KvCache(array("I", sequence[: cache.get_seq_length()]), cache)
+        with metrics.inference_stage.time(mode=mode, stage="decode"):
+            return self.tokenizer.decode(answer_ids, skip_special_tokens=True).split("<Bot>:")[-1].strip()
+
+    def _generation_kwargs(self) -> dict:
+        return {
+            "max_new_tokens": MAX_NEW_TOKENS,
+            "pad_token_id": self.tokenizer.eos_token_id,
+            "do_sample": False,
+            "num_beams": 1,
+        }
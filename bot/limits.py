@@ -0,0 +1,179 @@
+# bot/limits.py
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+from typing import NamedTuple
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+class LimitClass(NamedTuple):
+    rate_per_min: float
+    burst: int
+    # 0 — без ограничения одновременных запросов
+    concurrency: int
+    max_queue: int
+
+def _limit_class(name: str, rate_per_min: float, burst: int, concurrency: int, max_queue: int) -> LimitClass:
+    prefix = f"LIMIT_{name.upper()}_"
+    return LimitClass(
+        float(os.getenv(prefix + "RATE_PER_MIN", str(rate_per_min))),
+        int(os.getenv(prefix + "BURST", str(burst))),
+        int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        int(os.getenv(prefix + "QUEUE", str(max_queue))),
+    )
+
+# llm — генерация ответа, db — тяжёлые запросы к БД и выгрузки, cheap — всё остальное (включая вход)
+LIMIT_CLASSES = {
+    # конкурентность llm не меньше размера батча, иначе батчер не сможет собрать полный батч
+    "llm": _limit_class("llm", 6, 3, 16, 16),
+    "db": _limit_class("db", 12, 4, 8, 8),
+    "cheap": _limit_class("cheap", 60, 20, 0, 0),
+}
+LIMIT_MAX_TRACKED = int(os.getenv("LIMIT_MAX_TRACKED", "50000"))
+# одновременные апдейты PTB, которые ограниченные классы не могут занять: дешёвые команды не ждут за генерацией
+LIMIT_CHEAP_RESERVED = int(os.getenv("LIMIT_CHEAP_RESERVED", "8"))
+
+RATE_LIMITED_TEXT = "⏳ Слишком много запросов, подождите {seconds} с."
+QUEUED_TEXT = "⏳ Запрос в очереди, ответ придёт чуть позже."
+OVERLOADED_TEXT = "⏳ Сейчас много запросов, попробуйте чуть позже."
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, burst: int):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.warned = False
+
+# Лимиты на пользователя (token bucket) и на класс обработчиков (одновременные запросы + очередь)
+class Limiter:
+    def __init__(self, classes: dict[str, LimitClass] = LIMIT_CLASSES, max_tracked: int = LIMIT_MAX_TRACKED):
+        self.classes = dict(classes)
+        self.max_tracked = max_tracked
+        self._buckets: OrderedDict[tuple[int, str], TokenBucket] = OrderedDict()
+        self._slots = {name: asyncio.Semaphore(c.concurrency) for name, c in classes.items() if c.concurrency}
+        self.running = Counter()
+        self.waiting = Counter()
+        # <класс>.<исход>: allowed, rate_limited, queued, rejected
+        self.counters = Counter()
+
+    # Возвращает 0, если запрос разрешён, иначе сколько секунд ждать до следующего токена
+    def take(self, user_id: int, class_name: str) -> float:
+        limits = self.classes[class_name]
+        key = (user_id, class_name)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limits.burst)
+            while len(self._buckets) > self.max_tracked:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        now = time.monotonic()
+        rate = limits.rate_per_min / 60
+        bucket.tokens = min(limits.burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            return 0.0
+        return (1 - bucket.tokens) / rate if rate else math.inf
+
+    # Предупреждать о лимите один раз, а не на каждое сообщение флуда
+    def should_warn(self, user_id: int, class_name: str) -> bool:
+        bucket = self._buckets.get((user_id, class_name))
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
+
+    # класс → занятые слоты и длина очереди
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        return {name: {"running": self.running[name], "waiting": self.waiting[name]} for name in self._slots}
+
+    # Запрос ограниченного класса держит апдейт PTB и в очереди, и во время работы. Очереди урезаются так,
+    # чтобы cheap_reserved апдейтов из общего лимита всегда оставались дешёвым командам
+    def reserve_capacity(self, concurrent_updates: int, cheap_reserved: int = LIMIT_CHEAP_RESERVED) -> None:
+        limited = [name for name, c in self.classes.items() if c.concurrency]
+        configured = {name: self.classes[name].max_queue for name in limited}
+        excess = sum(self.classes[n].concurrency + self.classes[n].max_queue for n in limited)
+        excess -= concurrent_updates - cheap_reserved
+        while excess > 0:
+            # урезается самая длинная очередь
+            name = max(limited, key=lambda n: self.classes[n].max_queue, default=None)
+            if name is None or not self.classes[name].max_queue:
+                break
+            self.classes[name] = self.classes[name]._replace(max_queue=self.classes[name].max_queue - 1)
+            excess -= 1
+        if excess > 0:
+            logger.warning(
+                "Одновременные запросы ограниченных классов превышают лимит PTB (%d) на %d: дешёвые команды будут ждать",
+                concurrent_updates, excess,
+            )
+        for name in limited:
+            if self.classes[name].max_queue != configured[name]:
+                logger.info("Очередь класса %s урезана до %d под лимит PTB", name, self.classes[name].max_queue)
+
+limiter = Limiter()
+
+async def _notify(update: Update, text: str) -> None:
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+
+def rate_limited(class_name: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            user = update.effective_user
+            if user:
+                retry_after = limiter.take(user.id, class_name)
+                if retry_after:
+                    limiter.counters[f"{class_name}.rate_limited"] += 1
+                    if limiter.should_warn(user.id, class_name):
+                        await _notify(update, RATE_LIMITED_TEXT.format(seconds=math.ceil(retry_after)))
+                    return None
+            slots = limiter._slots.get(class_name)
+            if slots is None:
+                limiter.counters[f"{class_name}.allowed"] += 1
+                return await func(update, context, *args, **kwargs)
+            if slots.locked():
+                if limiter.waiting[class_name] >= limiter.classes[class_name].max_queue:
+                    limiter.counters[f"{class_name}.rejected"] += 1
+                    await _notify(update, OVERLOADED_TEXT)
+                    return None
+                limiter.counters[f"{class_name}.queued"] += 1
+                await _notify(update, QUEUED_TEXT)
+            limiter.waiting[class_name] += 1
+            try:
+                await slots.acquire()
+            finally:
+                limiter.waiting[class_name] -= 1
+            limiter.counters[f"{class_name}.allowed"] += 1
+            limiter.running[class_name] += 1
+            try:
+                return await func(update, context, *args, **kwargs)
+            finally:
+                limiter.running[class_name] -= 1
+                slots.release()
+        return wrapper
+    return decorator
+
+# Общий лимит на все апдейты пользователя (класс cheap); стоит в группе -1 перед остальными обработчиками
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = update.effective_user
+    if not user:
+        return
+    retry_after = limiter.take(user.id, "cheap")
+    if not retry_after:
+        limiter.counters["cheap.allowed"] += 1
+        return
+    limiter.counters["cheap.rate_limited"] += 1
+    if limiter.should_warn(user.id, "cheap"):
+        await _notify(update, RATE_LIMITED_TEXT.format(seconds=math.ceil(retry_after)))
+    raise ApplicationHandlerStop
@@ -1,14 +1,36 @@
 # bot/main.py
+# первым делом: отсчёт профиля запуска начинается с импорта этого модуля
+from bot.startup_profile import startup_profile
+import argparse
+import asyncio
 import logging
 import os
-import torch
 from telegram import BotCommand, Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 from dotenv import load_dotenv
-from transformers import AutoTokenizer, AutoModelForCausalLM
 
-from db.database import Base, engine, get_db
+# .env должен быть прочитан до импорта модулей, которые берут настройки из окружения
+load_dotenv()
+
+from sqlalchemy import select
+from db.database import async_engine, get_async_db
+from db.init_db import upgrade_db
 from bot.handlers.utils import log_activity
+from bot.inference import InferenceEngine, MAX_NEW_TOKENS
+from bot.model_loader import HUB_REPO_ID, load_model
+from bot.activity import activity_sink
+from bot.identity import identity_cache
+from bot.response_cache import response_cache
+from bot.passwords import password_hasher
+from bot.sessions import session_store
+from bot.limits import flood_guard, limiter
+from bot.update_processor import PerChatUpdateProcessor
+from bot import metrics
+from bot.watchdog import loop_watchdog
+from bot.reminders import reminder_scheduler
+from bot.flashcards import due_notifier, review_log
+from bot.faq import FaqIndex
+from bot.dialogue import DIALOGUE_MAX_TOKENS, DialogueStore
 import bot.handlers.auth as auth
 import bot.handlers.admin as admin
 import bot.handlers.manager as manager
@@ -19,31 +41,37 @@ import bot.handlers.settings as settings
 import bot.handlers.dashboard as dashboard
 import bot.handlers.feedback as feedback
 import bot.handlers.model_artifacts as artifacts
+import bot.handlers.flashcards as flashcards
 from bot.handlers import feedback
-from telegram.ext import CommandHandler, CallbackQueryHandler
+from telegram.ext import CommandHandler, CallbackQueryHandler, TypeHandler
 
 logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
+startup_profile.record("imports", startup_profile.started)
 
-Base.metadata.create_all(bind=engine)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
 
 @log_activity("start")
 async def start(update: Update, context):
     tg_user = update.effective_user
-    with get_db() as db:
-        existing = db.query(auth.User).filter(auth.User.telegram_id == tg_user.id).first()
+    if context.identity:
+        await update.message.reply_text(f"С возвращением, {tg_user.first_name}!")
+        return
+    async with get_async_db() as db:
+        existing = await db.scalar(select(auth.User.id).where(auth.User.telegram_id == tg_user.id))
         if not existing:
-            client_role = db.query(auth.Role).filter(auth.Role.name == "client").first()
+            client_role = await db.scalar(select(auth.Role).where(auth.Role.name == "client"))
             if not client_role:
                 client_role = auth.Role(name="client")
-                db.add(client_role); db.commit(); db.refresh(client_role)
+                db.add(client_role); await db.commit(); await db.refresh(client_role)
             new_user = auth.User(
                 telegram_id=tg_user.id,
                 username=tg_user.username or tg_user.first_name,
                 password_hash="",
                 role_id=client_role.id
             )
-            db.add(new_user); db.commit()
+            db.add(new_user); await db.commit()
+            identity_cache.invalidate(tg_user.id)
             await update.message.reply_text(f"Привет, {tg_user.first_name}! Вы зарегистрированы.")
         else:
             await update.message.reply_text(f"С возвращением, {tg_user.first_name}!")
@@ -51,8 +79,9 @@ async def start(update: Update, context):
 async def help_command(update: Update, context):
     cmds = [
         "/start","/help","/register","/login","/logout",
-        "/settings","/summarize","/stats","/stats_global",
-        "/upload","/list_files","/download","/manager_panel","/admin_panel"
+        "/settings","/reset","/summarize","/stats","/stats_global",
+        "/upload","/list_files","/download","/review","/cards","/add_card",
+        "/manager_panel","/admin_panel"
     ]
     await update.message.reply_text("Доступные команды:\n" + "\n".join(cmds))
 
@@ -61,34 +90,145 @@ async def set_commands(application):
         BotCommand("start","Начать"), BotCommand("help","Помощь"),
         BotCommand("register","Регистрация"), BotCommand("login","Вход"),
         BotCommand("logout","Выход"), BotCommand("settings","Настройки"),
+        BotCommand("reset","Начать диалог заново"),
         BotCommand("stats","Моя статистика"), BotCommand("stats_global","Общая статистика"),
         BotCommand("upload","Загрузить файл"), BotCommand("list_files","Мои файлы"),
+        BotCommand("review","Повторить карточки"), BotCommand("cards","Мои карточки"),
+        BotCommand("add_card","Добавить карточку"),
         BotCommand("manager_panel","Панель менеджера"), BotCommand("admin_panel","Панель администратора")
     ]
     await application.bot.set_my_commands(commands)
 
-def main():
-    load_dotenv()
-    TOKEN = os.getenv("TELEGRAM_TOKEN")
-    HF_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
-    if not TOKEN or not HF_TOKEN:
-        logger.error("Не заданы TELEGRAM_TOKEN или HUGGINGFACE_TOKEN")
+async def load_chat_model(application):
+    loaded = await asyncio.to_thread(load_model, HUB_REPO_ID, os.getenv("HUGGINGFACE_TOKEN"))
+    engine = InferenceEngine(loaded.model, loaded.tokenizer, loaded.device)
+    # квантизованная модель может отвечать иначе, чем fp32, поэтому режим входит в ревизию для кэша ответов;
+    # ответы прежней ревизии в кэше больше не действительны
+    await response_cache.set_model_revision(f"{loaded.revision}:{loaded.precision}")
+    engine.start()
+    # история вместе с ответом должна уместиться в позиционные эмбеддинги модели
+    max_tokens = min(DIALOGUE_MAX_TOKENS, loaded.model.config.max_position_embeddings - MAX_NEW_TOKENS)
+    chat.dialogues = DialogueStore(loaded.tokenizer, max_tokens=max_tokens)
+    chat.engine = engine
+    startup_profile.mark("model ready")
+    logger.info("Модель готова к работе")
+    # в режиме webhook по этому событию фронтенд отвечает на проверку готовности
+    model_ready = application.bot_data.get("model_ready")
+    if model_ready is not None:
+        model_ready.set()
+    if application.bot_data.get("startup_profile"):
+        logger.info(startup_profile.report())
+
+# Глубины очередей и счётчики кэшей снимаются в момент запроса /metrics из самих объектов
+def register_metrics(application) -> None:
+    registry = metrics.registry
+    registry.collected("bot_update_queue_depth", "Апдейты, ожидающие обработки в PTB", application.update_queue.qsize)
+    registry.collected(
+        "bot_inference_queue_depth", "Промпты в очереди батчера генерации",
+        lambda: chat.engine.queue_depth() if chat.engine else None,
+    )
+    registry.collected("bot_activity_buffer_rows", "Строки user_activity, ещё не записанные в БД", activity_sink.pending)
+    registry.collected(
+        "bot_dialogues_active", "Диалоги в памяти и диалоги с сохранённым KV-кэшем",
+        lambda: {("all",): chat.dialogues.count(), ("kv",): chat.dialogues.kv_count()} if chat.dialogues is not None else None,
+        labels=("kind",),
+    )
+    registry.collected("bot_model_ready", "Модель загружена", lambda: int(chat.engine is not None))
+    registry.collected(
+        "bot_db_pool_checked_out", "Соединения пула БД, выданные сессиям",
+        lambda: async_engine.pool.checkedout() if hasattr(async_engine.pool, "checkedout") else None,
+    )
+    registry.collected(
+        "bot_limiter_events_total", "Решения лимитера по классам обработчиков",
+        lambda: {tuple(key.split(".", 1)): value for key, value in limiter.counters.items()},
+        labels=("class", "outcome"), kind="counter",
+    )
+    registry.collected(
+        "bot_limiter_slots", "Занятые слоты и очередь ограниченных классов",
+        lambda: {(name, state): value for name, states in limiter.snapshot().items() for state, value in states.items()},
+        labels=("class", "state"),
+    )
+    registry.collected(
+        "bot_response_cache_requests_total", "Обращения к кэшу ответов модели",
+        lambda: {
+            ("memory_hit",): response_cache.memory_hits, ("db_hit",): response_cache.db_hits,
+            ("miss",): response_cache.misses,
+        },
+        labels=("result",), kind="counter",
+    )
+    registry.collected(
+        "bot_identity_cache_requests_total", "Обращения к кэшу пользователей и ролей",
+        lambda: {("hit",): identity_cache.hits, ("miss",): identity_cache.misses},
+        labels=("result",), kind="counter",
+    )
+
+async def start_metrics(application) -> None:
+    metrics.instrument_db(async_engine)
+    register_metrics(application)
+    if not metrics.METRICS_PORT:
         return
+    # у каждого воркера webhook-режима свой порт
+    port = metrics.METRICS_PORT + application.bot_data.get("worker", 0)
+    try:
+        application.bot_data["metrics_runner"] = await metrics.start_server(port=port)
+    except OSError as e:
+        logger.warning("Эндпоинт метрик на порту %d не запущен: %s", port, e)
+
+async def post_init(application):
+    activity_sink.start()
+    review_log.start()
+    await start_metrics(application)
+    loop_watchdog.start()
+    with startup_profile.phase("bcrypt calibration"):
+        await asyncio.to_thread(password_hasher.calibrate)
+    # модель грузится в фоне: бот начинает принимать апдейты сразу, FAQ и остальные команды работают
+    application.bot_data["background_tasks"] = [asyncio.create_task(load_chat_model(application))]
+    # из нескольких процессов-воркеров меню команд обновляет только первый
+    if application.bot_data.get("worker", 0) == 0:
+        application.bot_data["background_tasks"].append(asyncio.create_task(set_commands(application)))
+        # напоминания рассылает один процесс; повторную отправку исключает и отметка reminded_at в БД
+        reminder_scheduler.start(application)
+        due_notifier.start(application)
+    startup_profile.mark("polling")
+    if application.bot_data.get("startup_profile"):
+        logger.info(startup_profile.report())
 
-    REPO = "Dilshodbek11/ruDialoGPT-finetuned"
-    tokenizer_obj = AutoTokenizer.from_pretrained(REPO, use_auth_token=HF_TOKEN)
-    model_obj = AutoModelForCausalLM.from_pretrained(REPO, use_auth_token=HF_TOKEN)
-    device_obj = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model_obj.to(device_obj)
-    if tokenizer_obj.pad_token_id is None:
-        tokenizer_obj.add_special_tokens({"pad_token": tokenizer_obj.eos_token})
-        model_obj.resize_token_embeddings(len(tokenizer_obj))
+async def post_shutdown(application):
+    for task in application.bot_data.get("background_tasks", []):
+        task.cancel()
+    if chat.engine:
+        await chat.engine.stop()
+    await activity_sink.stop()
+    await review_log.stop()
+    await loop_watchdog.stop()
+    if "metrics_runner" in application.bot_data:
+        await application.bot_data["metrics_runner"].cleanup()
 
-    chat.tokenizer = tokenizer_obj
-    chat.model = model_obj
-    chat.device = device_obj
+def load_faq_index():
+    with startup_profile.phase("faq index"):
+        chat.faq_index = FaqIndex.load()
+    if chat.faq_index:
+        logger.info("Индекс FAQ загружен: %d вопросов", len(chat.faq_index.answers))
 
-    app = ApplicationBuilder().token(TOKEN).build()
+def build_application(token: str, with_updater: bool = True, request=None):
+    builder = (
+        ApplicationBuilder().token(token)
+        # без параллельной обработки апдейтов батчер никогда не увидит больше одного промпта;
+        # параллельно идут разные чаты, апдейты одного чата — по очереди (диалоги ConversationHandler)
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+        # сессии авторизации в БД: переживают перезапуск и общие для всех процессов бота
+        .persistence(session_store)
+    )
+    # воркеры webhook-режима получают апдейты от фронтенда, а не опрашивают Telegram сами
+    if not with_updater:
+        builder = builder.updater(None)
+    # подменённый транспорт Bot API (scripts/benchmark.py)
+    if request is not None:
+        builder = builder.request(request)
+    app = builder.build()
+    limiter.reserve_capacity(CONCURRENT_UPDATES)
+    # общий лимит на пользователя проверяется до любого обработчика
+    app.add_handler(TypeHandler(Update, flood_guard), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(auth.register_handler)
@@ -100,18 +240,48 @@ def main():
     app.add_handler(files.upload_handler)
     app.add_handler(files.list_files_handler)
     app.add_handler(files.download_file_handler)
+    app.add_handler(files.delete_file_handler)
     app.add_handler(manager.manager_panel_handler)
     app.add_handler(manager.manager_callback_handler)
     app.add_handler(admin.admin_panel_handler)
     app.add_handler(admin.admin_callback_handler)
     app.add_handler(admin.set_role_handler)
     app.add_handler(dashboard.dashboard_handler)
+    app.add_handler(CommandHandler("reset", chat.reset_command))
     app.add_handler(CommandHandler("feedback", feedback.request_feedback))
     app.add_handler(CallbackQueryHandler(feedback.process_feedback, pattern="^(like|dislike)$"))
     app.add_handler(artifacts.download_model_handler)
+    app.add_handler(flashcards.add_card_handler)
+    app.add_handler(flashcards.cards_handler)
+    app.add_handler(flashcards.review_handler)
+    app.add_handler(flashcards.review_callback_handler)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, chat.chat_handler))
+    app.post_init = post_init
+    app.post_shutdown = post_shutdown
+    return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--startup-profile", action="store_true", help="вывести время запуска по фазам")
+    parser.add_argument("--webhook", action="store_true", help="приём апдейтов через webhook и несколько процессов")
+    args = parser.parse_args()
+
+    TOKEN = os.getenv("TELEGRAM_TOKEN")
+    if not TOKEN:
+        logger.error("Не задан TELEGRAM_TOKEN")
+        return
+
+    with startup_profile.phase("migrations"):
+        upgrade_db(configure_logger=False)
+    if args.webhook:
+        from bot.webhook import serve
+        serve(TOKEN, startup_profile=args.startup_profile)
+        return
+    load_faq_index()
 
-    app.post_init = set_commands
+    with startup_profile.phase("application"):
+        app = build_application(TOKEN)
+    app.bot_data["startup_profile"] = args.startup_profile
     logger.info("Бот запущен")
     app.run_polling()
 
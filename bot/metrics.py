@@ -0,0 +1,223 @@
+# bot/metrics.py
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 — эндпоинт выключен; воркеры webhook-режима слушают METRICS_PORT + номер воркера
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# секунды: от быстрых команд и запросов к БД до генерации
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_PER_S_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: defaultdict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}" for key, v in values]
+
+# Гистограмма с фиксированными границами: observe — bisect и два сложения под блокировкой,
+# наблюдения могут приходить и из потоков генерации
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # по ключу меток: счётчики по корзинам (последняя — +Inf), сумма
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[n] for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+# Значение снимается в момент запроса /metrics: глубины очередей, счётчики кэшей из их собственных полей
+class Collected:
+    def __init__(self, name: str, help_text: str, collect, labels: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.kind = kind
+        # collect() возвращает число либо {кортеж значений меток: число}; None — метрика пока недоступна
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        try:
+            values = self.collect()
+        except Exception:
+            logger.exception("Не удалось снять метрику %s", self.name)
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(v)}" for key, v in values.items()]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def _register(self, metric):
+        # повторная регистрация (перезапуск приложения в том же процессе) заменяет сборщик
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def collected(self, name: str, help_text: str, collect, labels: tuple = (), kind: str = "gauge") -> Collected:
+        return self._register(Collected(name, help_text, collect, labels, kind))
+
+    # текстовый формат Prometheus 0.0.4
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+handler_latency = registry.histogram(
+    "bot_handler_latency_seconds", "Время обработчика от входа до ответа", ("handler",),
+)
+handler_errors = registry.counter("bot_handler_errors_total", "Исключения, вышедшие из обработчика", ("handler",))
+inference_stage = registry.histogram(
+    "bot_inference_stage_seconds", "Стадии генерации: tokenize, generate, decode", ("mode", "stage"),
+)
+inference_tokens_per_s = registry.histogram(
+    "bot_inference_tokens_per_second", "Скорость генерации новых токенов", ("mode",), TOKENS_PER_S_BUCKETS,
+)
+inference_tokens = registry.counter("bot_inference_generated_tokens_total", "Сгенерировано новых токенов", ("mode",))
+inference_batch_size = registry.histogram(
+    "bot_inference_batch_size", "Размер батча генерации", buckets=BATCH_SIZE_BUCKETS,
+)
+db_query_latency = registry.histogram(
+    "bot_db_query_seconds", "Время выполнения SQL-запроса", ("operation",),
+)
+
+def observe_generation(mode: str, seconds: float, new_tokens: int) -> None:
+    inference_stage.observe(seconds, mode=mode, stage="generate")
+    inference_tokens.inc(new_tokens, mode=mode)
+    if seconds > 0 and new_tokens:
+        inference_tokens_per_s.observe(new_tokens / seconds, mode=mode)
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[:1]
+    return word[0].upper() if word else "OTHER"
+
+# Время запросов через события движка SQLAlchemy; async_engine — через его sync_engine
+def instrument_db(engine) -> None:
+    from sqlalchemy import event
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    db_query_latency.observe(time.perf_counter() - started, operation=_operation(statement))
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_started"):
+        started = conn.info["query_started"].pop()
+        db_query_latency.observe(time.perf_counter() - started, operation="ERROR")
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8", headers={
+            "Cache-Control": "no-store",
+        })
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
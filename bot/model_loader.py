@@ -0,0 +1,159 @@
+# bot/model_loader.py
+import gc
+import json
+import logging
+import os
+import time
+from typing import Any, NamedTuple
+from bot.startup_profile import startup_profile
+
+logger = logging.getLogger(__name__)
+
+HUB_REPO_ID = "Dilshodbek11/ruDialoGPT-finetuned"
+# локальный снимок модели в safetensors (scripts/snapshot_model.py); без него модель качается с хаба
+MODEL_DIR = os.getenv("MODEL_DIR", "models/ruDialoGPT-finetuned")
+SNAPSHOT_META = "snapshot.json"
+
+# fp32 | int8 (динамическая квантизация Linear-слоёв, только CPU) | bf16; int8 и bf16 включаются явно
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32").lower()
+# самопроверка int8/bf16 против fp32 при запуске; 0 — пропустить (быстрее старт, расхождение не заметится)
+INFERENCE_SELF_CHECK = os.getenv("INFERENCE_SELF_CHECK", "1") == "1"
+SELF_CHECK_MIN_AGREEMENT = float(os.getenv("INFERENCE_SELF_CHECK_MIN_AGREEMENT", "0.9"))
+SELF_CHECK_NEW_TOKENS = 16
+SELF_CHECK_PROMPTS = [
+    "<User>: Когда начинается сессия?\n<Bot>:",
+    "<User>: Как скачать электронную книгу?\n<Bot>:",
+    "<User>: Где посмотреть расписание занятий?\n<Bot>:",
+    "<User>: Привет! Как дела?\n<Bot>:",
+]
+
+class LoadedModel(NamedTuple):
+    tokenizer: Any
+    model: Any
+    device: Any
+    precision: str
+    revision: str
+
+def _conv1d_to_linear(model) -> None:
+    # GPT-2 (и ruDialoGPT) хранит проекции в transformers Conv1D, который quantize_dynamic не видит.
+    # Conv1D(nf, nx) считает x @ W + b с W формы (nx, nf) — это nn.Linear(nx, nf) с весом W.T
+    from torch import nn
+    from transformers.pytorch_utils import Conv1D
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                nx, nf = child.weight.shape
+                linear = nn.Linear(nx, nf)
+                linear.weight = nn.Parameter(child.weight.detach().t().contiguous(), requires_grad=False)
+                linear.bias = nn.Parameter(child.bias.detach().clone(), requires_grad=False)
+                setattr(module, name, linear)
+
+def apply_precision(model, precision: str, device):
+    import torch
+    from torch import nn
+    if precision == "int8":
+        if device.type != "cpu":
+            logger.warning("int8-квантизация доступна только на CPU, модель остаётся в fp32")
+            return model
+        _conv1d_to_linear(model)
+        # на месте: fp32-веса Linear-слоёв освобождаются по мере замены
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    return model
+
+def _greedy_tokens(model, tokenizer, device) -> tuple[list[list[int]], float]:
+    import torch
+    started = time.perf_counter()
+    outputs = []
+    with torch.inference_mode():
+        for prompt in SELF_CHECK_PROMPTS:
+            inputs = tokenizer(prompt, return_tensors="pt").to(device)
+            ids = model.generate(
+                **inputs,
+                max_new_tokens=SELF_CHECK_NEW_TOKENS,
+                pad_token_id=tokenizer.eos_token_id,
+                do_sample=False,
+                num_beams=1,
+            )
+            outputs.append(ids[0, inputs.input_ids.shape[1]:].tolist())
+    return outputs, time.perf_counter() - started
+
+# Сравнивает жадные ответы оптимизированной модели с ответами fp32 (_greedy_tokens) на фиксированных промптах
+def self_check(reference: tuple[list[list[int]], float], candidate, tokenizer, device) -> float:
+    ref_tokens, ref_time = reference
+    cand_tokens, cand_time = _greedy_tokens(candidate, tokenizer, device)
+    matched = total = 0
+    for ref, cand in zip(ref_tokens, cand_tokens):
+        length = max(len(ref), len(cand))
+        matched += sum(1 for a, b in zip(ref, cand) if a == b)
+        total += length
+    agreement = matched / total if total else 1.0
+    logger.info(
+        "Самопроверка модели: совпадение токенов %.1f%%, время fp32 %.2f с, оптимизированной %.2f с",
+        agreement * 100, ref_time, cand_time,
+    )
+    return agreement
+
+def read_snapshot_meta(model_dir: str = MODEL_DIR) -> dict | None:
+    path = os.path.join(model_dir, SNAPSHOT_META)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _load_fp32(repo: str, hf_token: str | None, model_dir: str):
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    meta = read_snapshot_meta(model_dir)
+    if meta:
+        # safetensors читаются через mmap, pad-токен и размер эмбеддингов уже исправлены при конвертации
+        with startup_profile.phase("model: local snapshot"):
+            tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+            model = AutoModelForCausalLM.from_pretrained(model_dir, local_files_only=True, use_safetensors=True)
+        revision = meta["revision"]
+    else:
+        logger.warning("Локальный снимок модели %s не найден, загрузка с хаба (см. scripts/snapshot_model.py)", model_dir)
+        with startup_profile.phase("model: hub download"):
+            tokenizer = AutoTokenizer.from_pretrained(repo, token=hf_token)
+            model = AutoModelForCausalLM.from_pretrained(repo, token=hf_token)
+        revision = os.getenv("MODEL_REVISION") or getattr(model.config, "_commit_hash", None) or repo
+        if tokenizer.pad_token_id is None:
+            tokenizer.add_special_tokens({"pad_token": tokenizer.eos_token})
+            model.resize_token_embeddings(len(tokenizer))
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    model.eval()
+    return tokenizer, model, device, revision
+
+def load_model(
+    repo: str = HUB_REPO_ID, hf_token: str | None = None,
+    precision: str = INFERENCE_PRECISION, model_dir: str = MODEL_DIR,
+) -> LoadedModel:
+    tokenizer, model, device, revision = _load_fp32(repo, hf_token, model_dir)
+    if precision == "fp32" or (precision == "int8" and device.type != "cpu"):
+        return LoadedModel(tokenizer, model, device, "fp32", revision)
+    # эталон снимается с fp32-модели до преобразования: вторая копия весов в памяти не держится
+    reference = None
+    if INFERENCE_SELF_CHECK:
+        with startup_profile.phase("model: self-check fp32"):
+            reference = _greedy_tokens(model, tokenizer, device)
+    with startup_profile.phase(f"model: {precision}"):
+        model = apply_precision(model, precision, device).eval()
+    gc.collect()
+    if reference is not None:
+        with startup_profile.phase("model: self-check"):
+            agreement = self_check(reference, model, tokenizer, device)
+        if agreement < SELF_CHECK_MIN_AGREEMENT:
+            logger.warning(
+                "Режим %s расходится с fp32 (%.1f%% < %.1f%%), используется fp32",
+                precision, agreement * 100, SELF_CHECK_MIN_AGREEMENT * 100,
+            )
+            # преобразование необратимо: fp32 загружается заново (снимок читается через mmap)
+            del model
+            gc.collect()
+            tokenizer, model, device, revision = _load_fp32(repo, hf_token, model_dir)
+            return LoadedModel(tokenizer, model, device, "fp32", revision)
+    logger.info("Модель загружена в режиме %s", precision)
+    return LoadedModel(tokenizer, model, device, precision, revision)
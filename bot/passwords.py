@@ -0,0 +1,74 @@
+# bot/passwords.py
+import asyncio
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# целевое время одного хеширования; стоимость подбирается под него при запуске
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+PASSWORD_MIN_ROUNDS = int(os.getenv("PASSWORD_MIN_ROUNDS", "10"))
+PASSWORD_MAX_ROUNDS = int(os.getenv("PASSWORD_MAX_ROUNDS", "15"))
+# явно заданная стоимость отключает калибровку
+PASSWORD_ROUNDS = int(os.getenv("PASSWORD_ROUNDS", "0"))
+# bcrypt отпускает GIL, поэтому потоки хешируют параллельно; больше потоков, чем ядер, смысла не имеет
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+def hash_rounds(hashed: str) -> int | None:
+    # формат: $2b$<cost>$<salt+hash>
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+# Хеширование и проверка паролей в отдельном пуле потоков, чтобы не блокировать event loop
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_WORKERS, rounds: int = PASSWORD_ROUNDS or 12):
+        self.rounds = rounds
+        self.calibrated = bool(PASSWORD_ROUNDS)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # не больше одной операции на поток: остальные ждут в asyncio, а не в очереди пула
+        self._slots = asyncio.Semaphore(workers)
+
+    def calibrate(self, target_ms: float = PASSWORD_HASH_TARGET_MS) -> int:
+        if self.calibrated:
+            return self.rounds
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(PASSWORD_MIN_ROUNDS))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # каждый раунд удваивает время
+        extra = math.floor(math.log2(max(target_ms / elapsed_ms, 1)))
+        self.rounds = min(PASSWORD_MIN_ROUNDS + extra, PASSWORD_MAX_ROUNDS)
+        self.calibrated = True
+        logger.info("bcrypt: стоимость %d (%.0f мс при стоимости %d)", self.rounds, elapsed_ms, PASSWORD_MIN_ROUNDS)
+        return self.rounds
+
+    def hash_sync(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(self.rounds)).decode()
+
+    def verify_sync(self, password: str, hashed: str) -> bool:
+        # у пользователей, созданных через /start, пароля нет
+        if hash_rounds(hashed or "") is None:
+            return False
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hash_sync, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.verify_sync, password, hashed)
+
+    # хеш с меньшей стоимостью, чем текущая, пересчитывается при следующем успешном входе
+    def needs_rehash(self, hashed: str) -> bool:
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self.rounds
+
+    async def _run(self, fn, *args):
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,194 @@
+# bot/reminders.py
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+from sqlalchemy import func, select, true, update
+from telegram.error import Forbidden, BadRequest, RetryAfter
+from db.database import get_async_db
+from db.models import Deadline, User, UserSetting
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+# за сколько до дедлайна напоминать
+REMINDER_LEAD_S = float(os.getenv("REMINDER_LEAD_S", "3600"))
+# в памяти только напоминания ближайшего окна; окно перечитывается из БД чаще, чем истекает
+REMINDER_WINDOW_S = float(os.getenv("REMINDER_WINDOW_S", "900"))
+REMINDER_REFILL_S = float(os.getenv("REMINDER_REFILL_S", "300"))
+REMINDER_MAX_LOADED = int(os.getenv("REMINDER_MAX_LOADED", "20000"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "25"))
+# Telegram допускает около 30 сообщений в секунду на бота; запас оставлен для ответов на команды
+REMINDER_SEND_RATE = float(os.getenv("REMINDER_SEND_RATE", "20"))
+REMINDER_TIMEZONE = ZoneInfo(os.getenv("REMINDER_TIMEZONE", "Europe/Moscow"))
+
+REMINDER_TEXT = "⏰ Напоминание: «{event}» — срок {deadline}."
+
+reminders_total = metrics.registry.counter("bot_reminders_total", "Напоминания о дедлайнах по исходу", ("outcome",))
+
+class PendingReminder(NamedTuple):
+    deadline_id: int
+    chat_id: int
+    event_name: str | None
+    deadline_at: datetime
+    remind_at: float
+
+def _aware(value: datetime) -> datetime:
+    # SQLite возвращает время без часового пояса
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+# Куча ближайших напоминаний, пополняемая диапазонным запросом по deadline_at, и одна задача job_queue,
+# взведённая на вершину кучи, — а не задача на каждую строку и не опрос всей таблицы
+class ReminderScheduler:
+    def __init__(
+        self, lead_s: float = REMINDER_LEAD_S, window_s: float = REMINDER_WINDOW_S,
+        refill_s: float = REMINDER_REFILL_S, max_loaded: int = REMINDER_MAX_LOADED,
+        batch_size: int = REMINDER_BATCH_SIZE, send_rate: float = REMINDER_SEND_RATE,
+    ):
+        self.lead = lead_s
+        self.window = window_s
+        self.refill_interval = refill_s
+        self.max_loaded = max_loaded
+        self.batch_size = batch_size
+        self.send_rate = send_rate
+        self._heap: list[tuple[float, int]] = []
+        # deadline_id → актуальная запись; элемент кучи с другим remind_at устарел и пропускается
+        self._pending: dict[int, PendingReminder] = {}
+        self._application = None
+        self._fire_job = None
+        self._armed_at: float | None = None
+        self._send_lock = asyncio.Lock()
+
+    def start(self, application) -> None:
+        if application.job_queue is None:
+            logger.warning("JobQueue недоступна (pip install \"python-telegram-bot[job-queue]\"), напоминания выключены")
+            return
+        self._application = application
+        application.job_queue.run_repeating(self._refill_job, interval=self.refill_interval, first=0, name="reminders-refill")
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _refill_job(self, context) -> None:
+        await self.refill()
+
+    async def refill(self) -> None:
+        now = datetime.now(timezone.utc)
+        horizon = now + timedelta(seconds=self.lead + self.window)
+        async with get_async_db() as db:
+            rows = (await db.execute(
+                select(Deadline.id, Deadline.event_name, Deadline.deadline_at, User.telegram_id)
+                .join(User, User.id == Deadline.user_id)
+                .outerjoin(UserSetting, UserSetting.user_id == User.id)
+                .where(
+                    Deadline.reminded_at.is_(None),
+                    Deadline.deadline_at > now,
+                    Deadline.deadline_at <= horizon,
+                    User.telegram_id.is_not(None),
+                    func.coalesce(UserSetting.deadline_notifications, true()),
+                    func.coalesce(UserSetting.notifications_enabled, true()),
+                )
+                .order_by(Deadline.deadline_at)
+                .limit(self.max_loaded)
+            )).all()
+        for deadline_id, event_name, deadline_at, chat_id in rows:
+            deadline_at = _aware(deadline_at)
+            remind_at = deadline_at.timestamp() - self.lead
+            known = self._pending.get(deadline_id)
+            if known is not None and known.remind_at == remind_at:
+                continue
+            self._pending[deadline_id] = PendingReminder(deadline_id, chat_id, event_name, deadline_at, remind_at)
+            heapq.heappush(self._heap, (remind_at, deadline_id))
+        self._arm()
+
+    # одна задача run_once на ближайшее напоминание; перевзводится, если вершина кучи стала раньше
+    def _arm(self) -> None:
+        while self._heap and not self._is_current(*self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap or self._application is None:
+            return
+        at = self._heap[0][0]
+        if self._fire_job is not None and self._armed_at is not None and self._armed_at <= at:
+            return
+        if self._fire_job is not None:
+            self._fire_job.schedule_removal()
+        self._armed_at = at
+        self._fire_job = self._application.job_queue.run_once(
+            self._fire, when=max(0.0, at - time.time()), name="reminders-fire",
+        )
+
+    def _is_current(self, remind_at: float, deadline_id: int) -> bool:
+        reminder = self._pending.get(deadline_id)
+        return reminder is not None and reminder.remind_at == remind_at
+
+    def _pop_due(self) -> list[PendingReminder]:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            remind_at, deadline_id = heapq.heappop(self._heap)
+            if self._is_current(remind_at, deadline_id):
+                due.append(self._pending.pop(deadline_id))
+        return due
+
+    async def _fire(self, context) -> None:
+        self._fire_job = None
+        self._armed_at = None
+        # пока идёт рассылка большой пачки, следующие срабатывания ждут её, а не шлют параллельно
+        async with self._send_lock:
+            due = self._pop_due()
+            for start in range(0, len(due), self.batch_size):
+                batch = due[start:start + self.batch_size]
+                started = time.monotonic()
+                claimed = await self._claim([r.deadline_id for r in batch])
+                await asyncio.gather(*(self._send(context.bot, r) for r in batch if r.deadline_id in claimed))
+                # темп рассылки не выше send_rate сообщений в секунду
+                await asyncio.sleep(max(0.0, len(claimed) / self.send_rate - (time.monotonic() - started)))
+        self._arm()
+
+    # Отметка reminded_at ставится до отправки одним UPDATE … RETURNING: строку, уже отмеченную
+    # другим процессом или до перезапуска, повторно не отправляем
+    async def _claim(self, deadline_ids: list[int]) -> set[int]:
+        async with get_async_db() as db:
+            result = await db.execute(
+                update(Deadline)
+                .where(Deadline.id.in_(deadline_ids), Deadline.reminded_at.is_(None))
+                .values(reminded_at=datetime.now(timezone.utc))
+                .returning(Deadline.id)
+            )
+            claimed = set(result.scalars())
+            await db.commit()
+        return claimed
+
+    async def _send(self, bot, reminder: PendingReminder) -> None:
+        text = REMINDER_TEXT.format(
+            event=reminder.event_name or "без названия",
+            deadline=reminder.deadline_at.astimezone(REMINDER_TIMEZONE).strftime("%d.%m.%Y %H:%M"),
+        )
+        reminders_total.inc(outcome=await send_notification(bot, reminder.chat_id, text))
+
+# Одно уведомление с повтором после RetryAfter; возвращает исход: sent, undeliverable или failed
+async def send_notification(bot, chat_id: int, text: str, **kwargs) -> str:
+    for attempt in range(2):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return "sent"
+        except RetryAfter as e:
+            if attempt:
+                break
+            await asyncio.sleep(e.retry_after)
+        except (Forbidden, BadRequest) as e:
+            # пользователь заблокировал бота или чат недоступен
+            logger.info("Уведомление в чат %d не доставлено: %s", chat_id, e)
+            return "undeliverable"
+        except Exception:
+            logger.exception("Ошибка отправки уведомления в чат %d", chat_id)
+            break
+    return "failed"
+
+reminder_scheduler = ReminderScheduler()
+
+metrics.registry.collected("bot_reminders_pending", "Напоминания ближайшего окна в памяти", reminder_scheduler.pending)
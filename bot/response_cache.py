@@ -0,0 +1,100 @@
+# bot/response_cache.py
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.database import get_async_db
+from db.models import ResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_PERSISTENT = os.getenv("RESPONSE_CACHE_PERSISTENT", "1") == "1"
+
+_GREETING_RE = re.compile(
+    r"^(?:(?:привет(?:ствую)?|здравствуй(?:те)?|добр(?:ый|ое|ого) (?:день|утро|вечер|времени суток)|"
+    r"hello|hi|hey)\s+)+"
+)
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_SPACES_RE = re.compile(r"\s+")
+
+def normalize_prompt(text: str) -> str:
+    text = _PUNCT_RE.sub(" ", text.lower().replace("ё", "е"))
+    text = _SPACES_RE.sub(" ", text).strip()
+    # сообщение из одного приветствия оставляем как есть, иначе все приветствия слились бы в один ключ
+    return _GREETING_RE.sub("", text + " ").strip() or text
+
+# Генерация жадная (do_sample=False), поэтому одинаковый промпт даёт одинаковый ответ и его можно кэшировать.
+# Два уровня: LRU в памяти и таблица response_cache в общей БД; ключ включает ревизию модели.
+class ResponseCache:
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, persistent: bool = RESPONSE_CACHE_PERSISTENT):
+        self.max_size = max_size
+        self.persistent = persistent
+        self.model_revision: str | None = None
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    async def set_model_revision(self, revision: str) -> None:
+        if revision == self.model_revision:
+            return
+        self.model_revision = revision
+        self._entries.clear()
+        if self.persistent:
+            async with get_async_db() as db:
+                result = await db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.model_revision != revision))
+                await db.commit()
+            if result.rowcount:
+                logger.info("Кэш ответов: удалено %d записей прежних ревизий модели", result.rowcount)
+
+    # context — отпечаток истории диалога (Dialogue.context_key); пустой у первого хода
+    def _key(self, prompt_norm: str, context: str = "") -> str:
+        return hashlib.sha256(f"{self.model_revision}\0{context}\0{prompt_norm}".encode()).hexdigest()
+
+    async def get(self, text: str, context: str = "") -> str | None:
+        if self.model_revision is None:
+            return None
+        key = self._key(normalize_prompt(text), context)
+        answer = self._entries.get(key)
+        if answer is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return answer
+        if self.persistent:
+            async with get_async_db() as db:
+                answer = await db.scalar(select(ResponseCacheEntry.answer).where(ResponseCacheEntry.prompt_hash == key))
+            if answer is not None:
+                self._remember(key, answer)
+                self.db_hits += 1
+                return answer
+        self.misses += 1
+        return None
+
+    async def put(self, text: str, answer: str, context: str = "") -> None:
+        if self.model_revision is None or not answer:
+            return
+        prompt_norm = normalize_prompt(text)
+        key = self._key(prompt_norm, context)
+        self._remember(key, answer)
+        if self.persistent:
+            async with get_async_db() as db:
+                insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+                await db.execute(
+                    insert(ResponseCacheEntry)
+                    .values(prompt_hash=key, model_revision=self.model_revision, prompt_norm=prompt_norm, answer=answer)
+                    .on_conflict_do_nothing(index_elements=["prompt_hash"])
+                )
+                await db.commit()
+
+    def _remember(self, key: str, answer: str) -> None:
+        self._entries[key] = answer
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+response_cache = ResponseCache()
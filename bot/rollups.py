@@ -0,0 +1,76 @@
+# bot/rollups.py
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.models import ActivityRollup
+
+ALL_USERS = 0
+ALL_HANDLERS = ""
+# бакет «за всё время»: по нему /stats и /stats_global читают одну строку вместо всей истории
+TOTAL_BUCKET = datetime(1970, 1, 1, tzinfo=timezone.utc)
+LATENCY_BUCKETS_MS = (
+    (50, "le_50_ms"), (100, "le_100_ms"), (250, "le_250_ms"), (500, "le_500_ms"),
+    (1000, "le_1000_ms"), (2500, "le_2500_ms"), (5000, "le_5000_ms"),
+)
+INF_BUCKET = "le_inf_ms"
+HISTOGRAM_COLUMNS = [name for _, name in LATENCY_BUCKETS_MS] + [INF_BUCKET]
+KEY_COLUMNS = ["granularity", "bucket_start", "user_id", "handler_name"]
+
+def _latency_bucket(ms: int) -> str:
+    for bound, name in LATENCY_BUCKETS_MS:
+        if ms <= bound:
+            return name
+    return INF_BUCKET
+
+def _buckets(ts: datetime):
+    # SQLite возвращает наивные datetime, время в них и так UTC
+    ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+    hour = ts.replace(minute=0, second=0, microsecond=0)
+    yield "hour", hour
+    yield "day", hour.replace(hour=0)
+    yield "total", TOTAL_BUCKET
+
+def _dimensions(row):
+    dims = {(ALL_USERS, ALL_HANDLERS), (ALL_USERS, row["handler_name"] or ALL_HANDLERS)}
+    if row["user_id"]:
+        dims.add((row["user_id"], ALL_HANDLERS))
+    return dims
+
+# строки user_activity → приращения агрегатов, по одному на ключ (бакет, пользователь, хендлер)
+def aggregate(rows) -> list[dict]:
+    deltas: dict[tuple, dict] = defaultdict(lambda: dict.fromkeys(
+        ["request_count", "response_time_sum_ms", "response_time_max_ms", *HISTOGRAM_COLUMNS], 0
+    ))
+    for row in rows:
+        ms = row["response_time_ms"] or 0
+        latency_bucket = _latency_bucket(ms)
+        for granularity, start in _buckets(row["timestamp"]):
+            for user_id, handler in _dimensions(row):
+                d = deltas[(granularity, start, user_id, handler)]
+                d["request_count"] += 1
+                d["response_time_sum_ms"] += ms
+                d["response_time_max_ms"] = max(d["response_time_max_ms"], ms)
+                d[latency_bucket] += 1
+    # фиксированный порядок ключей, чтобы параллельные upsert'ы из разных воркеров не ловили deadlock
+    return [dict(zip(KEY_COLUMNS, key), **values) for key, values in sorted(deltas.items())]
+
+UPSERT_CHUNK = 500
+
+def upsert_statements(dialect_name: str, deltas: list[dict]):
+    for i in range(0, len(deltas), UPSERT_CHUNK):
+        yield _upsert_statement(dialect_name, deltas[i:i + UPSERT_CHUNK])
+
+def _upsert_statement(dialect_name: str, deltas: list[dict]):
+    if dialect_name == "postgresql":
+        stmt, greatest = pg_insert(ActivityRollup), func.greatest
+    else:
+        stmt, greatest = sqlite_insert(ActivityRollup), func.max
+    stmt = stmt.values(deltas)
+    added = {
+        name: getattr(ActivityRollup, name) + getattr(stmt.excluded, name)
+        for name in ["request_count", "response_time_sum_ms", *HISTOGRAM_COLUMNS]
+    }
+    added["response_time_max_ms"] = greatest(ActivityRollup.response_time_max_ms, stmt.excluded.response_time_max_ms)
+    return stmt.on_conflict_do_update(index_elements=KEY_COLUMNS, set_=added)
@@ -0,0 +1,286 @@
+# bot/sessions.py
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from telegram.ext import BasePersistence, PersistenceInput
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.database import get_async_db
+from db.models import Session
+
+logger = logging.getLogger(__name__)
+
+# сохраняются только ключи авторизации; промежуточные значения диалогов (reg_username и т.п.) остаются в памяти
+SESSION_KEYS = ("is_authenticated", "user_id", "username", "role")
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", str(7 * 24 * 3600)))
+# как часто PTB отдаёт изменённые user_data в хранилище; все изменения за интервал пишутся одной транзакцией
+SESSION_UPDATE_INTERVAL_S = float(os.getenv("SESSION_UPDATE_INTERVAL_S", "5"))
+# как часто сессия целиком перечитывается из БД; 0 — на каждом апдейте. У вошедших пользователей
+# версия сессии сверяется на каждом апдейте, поэтому смена роли и выход в другом процессе действуют сразу
+SESSION_REFRESH_S = float(os.getenv("SESSION_REFRESH_S", "60"))
+# состояние сессий в памяти: не больше стольких пользователей, простаивающие дольше SESSION_CACHE_IDLE_S забываются
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "50000"))
+SESSION_CACHE_IDLE_S = float(os.getenv("SESSION_CACHE_IDLE_S", "3600"))
+SESSION_PURGE_INTERVAL_S = float(os.getenv("SESSION_PURGE_INTERVAL_S", "600"))
+
+def _session(user_data: dict) -> dict:
+    return {key: user_data[key] for key in SESSION_KEYS if key in user_data}
+
+# Персистентность PTB для сессий: user_data[SESSION_KEYS] в таблице sessions с TTL
+class SessionPersistence(BasePersistence):
+    def __init__(self, ttl_s: float = SESSION_TTL_S, update_interval: float = SESSION_UPDATE_INTERVAL_S,
+                 refresh_s: float = SESSION_REFRESH_S, cache_size: int = SESSION_CACHE_SIZE,
+                 cache_idle_s: float = SESSION_CACHE_IDLE_S):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.ttl = ttl_s
+        self.refresh_s = refresh_s
+        self.cache_size = cache_size
+        # забытый пользователь при следующем апдейте сверяется с БД, поэтому забывать можно только тех,
+        # чьи локальные изменения уже точно дошли до записи
+        self.cache_idle = max(cache_idle_s, 2 * update_interval)
+        # последнее известное состояние сессии в БД: с ним сравниваются и локальные, и чужие изменения
+        self._stored: dict[int, dict] = {}
+        # версия сессии в БД, соответствующая _stored; None — строки нет
+        self._versions: dict[int, int | None] = {}
+        # время последней сверки с БД или записи; порядок — от давних к свежим
+        self._checked_at: OrderedDict[int, float] = OrderedDict()
+        self._pending: dict[int, dict] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._purged_at = 0.0
+
+    async def get_user_data(self) -> dict:
+        # сессии подтягиваются по одной в refresh_user_data, а не все сразу при запуске
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name, key, new_state) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        session = _session(data)
+        # большинство апдейтов user_data не трогают авторизацию
+        if session == self._stored.get(user_id, {}) and user_id not in self._pending:
+            return
+        self._schedule(user_id, session)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._schedule(user_id, {})
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        local = _session(user_data)
+        stored = self._stored.get(user_id)
+        # локальное изменение ещё не записано: до записи прав процесс, который его сделал (кроме роли)
+        dirty = user_id in self._pending or (stored is not None and local != stored)
+        now = time.monotonic()
+        if dirty or (self.refresh_s and now - self._checked_at.get(user_id, float("-inf")) < self.refresh_s):
+            if "role" not in local:
+                return
+            # у вошедших версия сверяется на каждом апдейте: это поиск по первичному ключу без чтения data
+            async with get_async_db() as db:
+                version = await db.scalar(select(Session.version).where(Session.telegram_id == user_id))
+            if version == self._versions.get(user_id):
+                return
+        self._touch(user_id, now)
+        async with get_async_db() as db:
+            row = (
+                await db.execute(
+                    select(Session.data, Session.expires_at, Session.version).where(Session.telegram_id == user_id)
+                )
+            ).first()
+        remote = {}
+        if row:
+            expires_at = row.expires_at if row.expires_at.tzinfo else row.expires_at.replace(tzinfo=timezone.utc)
+            left = (expires_at - datetime.now(timezone.utc)).total_seconds()
+            if left > 0:
+                remote = json.loads(row.data)
+                # скользящий TTL: продлеваем активную сессию, но не чаще раза за половину срока
+                if left < self.ttl / 2 and not dirty:
+                    self._schedule(user_id, remote)
+        self._versions[user_id] = row.version if row else None
+        if dirty:
+            # из чужой записи берётся только роль того же аккаунта; с новой версией её унесёт и локальная запись
+            if "role" in remote and remote.get("user_id") == local.get("user_id"):
+                user_data["role"] = remote["role"]
+                if self._pending.get(user_id):
+                    self._pending[user_id] = {**self._pending[user_id], "role": remote["role"]}
+            return
+        self._stored[user_id] = remote
+        if remote != local:
+            for key in SESSION_KEYS:
+                user_data.pop(key, None)
+            user_data.update(remote)
+
+    # Роль меняется прямо в сохранённых сессиях аккаунта; процессы замечают новую версию на следующем апдейте
+    async def update_role(self, account_id: int, role: str) -> None:
+        query = select(Session.telegram_id, Session.data, Session.version).where(Session.account_id == account_id)
+        async with get_async_db() as db:
+            rows = (await db.execute(query)).all()
+            while rows:
+                missed = []
+                for row in rows:
+                    data = json.loads(row.data)
+                    data["role"] = role
+                    # сессию успели переписать после чтения: перечитываем её, а не затираем
+                    done = await db.scalar(
+                        update(Session)
+                        .where(Session.telegram_id == row.telegram_id, Session.version == row.version)
+                        .values(data=json.dumps(data), version=Session.version + 1)
+                        .returning(Session.telegram_id)
+                    )
+                    if done is None:
+                        missed.append(row.telegram_id)
+                rows = (await db.execute(query.where(Session.telegram_id.in_(missed)))).all() if missed else []
+            await db.commit()
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
+
+    def _touch(self, user_id: int, now: float) -> None:
+        self._checked_at[user_id] = now
+        self._checked_at.move_to_end(user_id)
+        while self._checked_at:
+            oldest, checked_at = next(iter(self._checked_at.items()))
+            idle = now - checked_at
+            if oldest in self._pending or idle < 2 * self.update_interval:
+                break
+            if len(self._checked_at) <= self.cache_size and idle < self.cache_idle:
+                break
+            del self._checked_at[oldest]
+            self._stored.pop(oldest, None)
+            self._versions.pop(oldest, None)
+
+    def _schedule(self, user_id: int, session: dict) -> None:
+        self._pending[user_id] = session
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self) -> None:
+        try:
+            # update_persistence вызывает update_user_data для всех пользователей разом: ждём, пока все встанут в очередь
+            await asyncio.sleep(0)
+            await self._write()
+        finally:
+            self._flush_task = None
+
+    # Пишет сессии, только если версия в БД та, от которой они посчитаны; возвращает новые версии записанных
+    async def _upsert(self, db, sessions: dict[int, tuple[dict, int | None]], expires_at: datetime) -> dict[int, int]:
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(Session).values([
+            {
+                "telegram_id": uid, "account_id": s.get("user_id"), "data": json.dumps(s), "expires_at": expires_at,
+                # новая версия; для строки, которой не было, условие ниже не выполнится ни для какой чужой
+                "version": 0 if version is None else version + 1,
+            }
+            for uid, (s, version) in sessions.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Session.telegram_id],
+            set_={
+                "account_id": stmt.excluded.account_id,
+                "data": stmt.excluded.data,
+                "expires_at": stmt.excluded.expires_at,
+                "version": stmt.excluded.version,
+                "updated_at": datetime.now(timezone.utc),
+            },
+            where=Session.version == stmt.excluded.version - 1,
+        )
+        return dict((await db.execute(stmt.returning(Session.telegram_id, Session.version))).all())
+
+    async def _write(self) -> None:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        alive = {uid: s for uid, s in pending.items() if s}
+        dropped = [uid for uid, s in pending.items() if not s]
+        written: dict[int, int] = {}
+        # сессии, в которые подмешана роль из БД: их user_data ещё со старой ролью и перечитается на следующем апдейте
+        merged = set()
+        try:
+            async with get_async_db() as db:
+                if alive:
+                    written = await self._upsert(
+                        db, {uid: (s, self._versions.get(uid)) for uid, s in alive.items()}, expires_at
+                    )
+                    stale = [uid for uid in alive if uid not in written]
+                    if stale:
+                        # строку переписал другой процесс или update_role: роль того же аккаунта берётся из БД
+                        rows = (
+                            await db.execute(
+                                select(Session.telegram_id, Session.account_id, Session.data, Session.version)
+                                .where(Session.telegram_id.in_(stale))
+                            )
+                        ).all()
+                        retry = {uid: (alive[uid], None) for uid in stale}
+                        for row in rows:
+                            s, remote = alive[row.telegram_id], json.loads(row.data)
+                            if "role" in remote and row.account_id == s.get("user_id") and remote["role"] != s.get("role"):
+                                s = {**s, "role": remote["role"]}
+                                merged.add(row.telegram_id)
+                            retry[row.telegram_id] = (s, row.version)
+                        written.update(await self._upsert(db, retry, expires_at))
+                if dropped:
+                    await db.execute(delete(Session).where(Session.telegram_id.in_(dropped)))
+                if time.monotonic() - self._purged_at > SESSION_PURGE_INTERVAL_S:
+                    await db.execute(delete(Session).where(Session.expires_at < datetime.now(timezone.utc)))
+                    self._purged_at = time.monotonic()
+                await db.commit()
+        except Exception:
+            logger.exception("Не удалось сохранить %d сессий", len(pending))
+            # не затираем то, что успело измениться, пока шла запись
+            for uid, s in pending.items():
+                self._pending.setdefault(uid, s)
+            return
+        now = time.monotonic()
+        for uid, s in pending.items():
+            if s and uid not in written:
+                # строку снова переписали между чтением и записью: попробуем при следующей записи
+                self._pending.setdefault(uid, s)
+                continue
+            self._stored[uid] = s
+            if uid in merged:
+                self._versions.pop(uid, None)
+            else:
+                self._versions[uid] = written.get(uid)
+            self._touch(uid, now)
+
+session_store = SessionPersistence()
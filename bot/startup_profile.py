@@ -0,0 +1,37 @@
+# bot/startup_profile.py
+import threading
+import time
+from contextlib import contextmanager
+
+# Время запуска по фазам; фазы из фонового потока загрузки модели пишутся сюда же
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, began)
+
+    def record(self, name: str, began: float) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, now - began, now - self.started))
+
+    def mark(self, name: str) -> None:
+        self.record(name, time.perf_counter())
+
+    def report(self) -> str:
+        with self._lock:
+            phases = list(self.phases)
+        lines = ["Профиль запуска (фаза: длительность / с момента старта):"]
+        for name, duration, elapsed in phases:
+            lines.append(f"  {name:<28} {duration * 1000:8.0f} мс  {elapsed * 1000:8.0f} мс")
+        return "\n".join(lines)
+
+startup_profile = StartupProfile()
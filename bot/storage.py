@@ -0,0 +1,239 @@
+# bot/storage.py
+import abc
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple
+from urllib.parse import urlparse
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.database import get_async_db
+from db.models import Blob, File
+
+logger = logging.getLogger(__name__)
+
+# local | s3
+FILE_STORAGE = os.getenv("FILE_STORAGE", "local").lower()
+FILE_STORAGE_DIR = os.getenv("FILE_STORAGE_DIR", "uploads")
+# S3-совместимое хранилище; S3_ENDPOINT_URL позволяет указать MinIO или другой локальный стенд
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+CHUNK_SIZE = 256 * 1024
+
+def blob_key(sha256: str) -> str:
+    # два уровня по 256 каталогов, чтобы ни в одном каталоге не копились миллионы файлов
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+class StagedBlob(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+# Интерфейс хранилища blob'ов; ключи — результат blob_key()
+class BlobStorage(abc.ABC):
+    # каталог для временных файлов, пока содержимое скачивается и хешируется
+    staging_dir: str
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool: ...
+
+    # забирает staged-файл: после вызова его на месте больше нет
+    @abc.abstractmethod
+    async def put(self, key: str, staged_path: str) -> None: ...
+
+    @abc.abstractmethod
+    async def open(self, key: str) -> BinaryIO: ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+class LocalBlobStorage(BlobStorage):
+    def __init__(self, root: str = FILE_STORAGE_DIR):
+        self.root = root
+        # staging внутри корня: на той же файловой системе os.replace атомарен и ничего не копирует
+        self.staging_dir = os.path.join(root, ".staging")
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    async def put(self, key: str, staged_path: str) -> None:
+        target = self.path(key)
+        if os.path.exists(target):
+            os.unlink(staged_path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staged_path, target)
+
+    async def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    async def delete(self, key: str) -> None:
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+class S3BlobStorage(BlobStorage):
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str | None = S3_ENDPOINT_URL):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("FILE_STORAGE=s3 требует пакет boto3")
+        if not bucket:
+            raise RuntimeError("FILE_STORAGE=s3 требует S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.staging_dir = tempfile.gettempdir()
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def put(self, key: str, staged_path: str) -> None:
+        try:
+            if not await self.exists(key):
+                await asyncio.to_thread(self.client.upload_file, staged_path, self.bucket, self._object_key(key))
+        finally:
+            os.unlink(staged_path)
+
+    # объект скачивается во временный файл в потоке: StreamingBody читался бы синхронно прямо в event loop
+    async def open(self, key: str) -> BinaryIO:
+        f = tempfile.TemporaryFile(dir=self.staging_dir)
+        try:
+            await asyncio.to_thread(self.client.download_fileobj, self.bucket, self._object_key(key), f)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+
+def create_storage(kind: str = FILE_STORAGE) -> BlobStorage:
+    if kind == "local":
+        return LocalBlobStorage()
+    if kind == "s3":
+        return S3BlobStorage()
+    raise ValueError(f"неизвестный FILE_STORAGE: {kind}")
+
+async def _iter_telegram_file(file_path: str):
+    # облачный Bot API отдаёт файл по URL, локальный сервер Bot API — путём на диске
+    if urlparse(file_path).scheme in ("http", "https"):
+        import httpx
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30, read=120)) as client:
+            async with client.stream("GET", file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    yield chunk
+    else:
+        with open(file_path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                yield chunk
+
+# Скачивает файл Telegram во временный файл, считая SHA-256 по ходу, без буферизации всего файла в памяти
+async def stage_telegram_file(file_obj, staging_dir: str) -> StagedBlob:
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=staging_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            async for chunk in _iter_telegram_file(file_obj.file_path):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return StagedBlob(path, digest.hexdigest(), size)
+
+# Файловое хранилище с дедупликацией: blob'ы в BlobStorage, учёт ссылок в таблице blobs
+class FileStore:
+    def __init__(self, storage: BlobStorage | None = None):
+        self._storage = storage
+
+    @property
+    def storage(self) -> BlobStorage:
+        if self._storage is None:
+            self._storage = create_storage()
+        return self._storage
+
+    # Сохраняет файл (или находит уже сохранённый такой же), увеличивает счётчик ссылок и записывает record.
+    # Скачивание и хеширование идут до открытия сессии: соединение из пула не простаивает в транзакции,
+    # пока файл качается, — сессии нужны только на UPDATE/upsert счётчика и INSERT записи
+    async def add_telegram_file(self, file_obj, record: File) -> None:
+        if file_obj.file_unique_id:
+            async with get_async_db() as db:
+                # blob находится и засчитывается одним UPDATE: удалённый в этот момент release() blob не подхватится
+                sha256 = await db.scalar(
+                    update(Blob).where(Blob.telegram_unique_id == file_obj.file_unique_id, Blob.ref_count > 0)
+                    .values(ref_count=Blob.ref_count + 1)
+                    .returning(Blob.sha256)
+                )
+                if sha256 is not None:
+                    await self._attach(db, record, sha256)
+                    return
+        staged = await stage_telegram_file(file_obj, self.storage.staging_dir)
+        try:
+            async with get_async_db() as db:
+                # строка blobs занимается до записи содержимого: параллельный release() того же blob'а
+                # либо увидит нашу ссылку, либо успеет удалить содержимое раньше, чем мы его положим
+                await self._upsert(db, staged.sha256, staged.size, file_obj.file_unique_id)
+                await self.storage.put(blob_key(staged.sha256), staged.path)
+                await self._attach(db, record, staged.sha256)
+        finally:
+            # put() забирает staged-файл; он остаётся, только если до put() дело не дошло
+            if os.path.exists(staged.path):
+                os.unlink(staged.path)
+
+    @staticmethod
+    async def _attach(db, record: File, sha256: str) -> None:
+        record.blob_sha256 = sha256
+        record.file_path = blob_key(sha256)
+        db.add(record)
+        await db.commit()
+
+    # Уменьшает счётчик ссылок и коммитит сессию вместе с изменениями вызывающего (удалением File).
+    # Blob без ссылок удаляется DELETE … RETURNING в той же транзакции, и содержимое стирается до commit:
+    # пока строка заблокирована, параллельная загрузка того же содержимого её не засчитает
+    async def release(self, db, sha256: str) -> None:
+        await db.execute(update(Blob).where(Blob.sha256 == sha256).values(ref_count=Blob.ref_count - 1))
+        claimed = await db.scalar(
+            delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0).returning(Blob.sha256)
+        )
+        if claimed is not None:
+            await self.storage.delete(blob_key(sha256))
+        await db.commit()
+
+    async def open(self, file_record) -> BinaryIO:
+        if file_record.blob_sha256:
+            return await self.storage.open(blob_key(file_record.blob_sha256))
+        # записи до перехода на blob'ы хранят путь к файлу на диске
+        return open(file_record.file_path, "rb")
+
+    async def _upsert(self, db, sha256: str, size: int, unique_id: str | None) -> None:
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(Blob).values(sha256=sha256, size=size, ref_count=1, telegram_unique_id=unique_id)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[Blob.sha256], set_={"ref_count": Blob.ref_count + 1},
+        ))
+
+file_store = FileStore()
@@ -0,0 +1,45 @@
+# bot/update_processor.py
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Апдейты одного чата обрабатываются строго по очереди, разных чатов — параллельно.
+# ConversationHandler (вход, регистрация, загрузка, настройки) не рассчитан на то, что два апдейта
+# одного чата читают и меняют его состояние одновременно
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        # семафор базового класса берётся до do_process_update: апдейт, ждущий своей очереди в чате,
+        # занимал бы общий слот, и один флудящий чат мог бы занять их все. Поэтому общий лимит
+        # соблюдается своим семафором, уже после очереди чата
+        super().__init__(2**31 - 1)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # chat_id → (замок, число апдейтов чата в обработке и в очереди); запись удаляется вместе с последним
+        self._chats: dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = None
+        if isinstance(update, Update):
+            # апдейты без чата (inline-запросы и т. п.) упорядочиваются по пользователю
+            chat = update.effective_chat or update.effective_user
+            key = chat.id if chat else None
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,188 @@
+# bot/watchdog.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from bot import metrics
+from bot.handlers.utils import log_activity
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100"))
+# задержка, после которой event loop считается заблокированным и снимается его стек
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "300"))
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", "50"))
+# пустой PROFILE_DIR — профилировщик выключен
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_FLUSH_S = float(os.getenv("PROFILE_FLUSH_S", "60"))
+PROFILE_MAX_DEPTH = 64
+
+loop_lag = metrics.registry.histogram(
+    "bot_event_loop_lag_seconds", "Опоздание периодической задачи event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+loop_stalls = metrics.registry.counter(
+    "bot_event_loop_stalls_total", "Блокировки event loop дольше порога", ("handler",),
+)
+
+# у всех обёрток log_activity один объект кода, по нему кадр обработчика находится в чужом стеке
+_HANDLER_WRAPPER_CODE = log_activity("")(lambda update, context: None).__code__
+
+# верхние кадры простаивающих потоков: ожидание задач, select event loop'а
+_IDLE_FRAMES = {
+    ("thread.py", "_worker"), ("threading.py", "wait"), ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+def handler_name(frame) -> str | None:
+    # ближайшая к вершине стека обёртка log_activity — обработчик, который сейчас выполняется
+    while frame is not None:
+        if frame.f_code is _HANDLER_WRAPPER_CODE:
+            return frame.f_locals.get("handler_name")
+        frame = frame.f_back
+    return None
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES
+
+def _folded(frame) -> str:
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        # строка начала функции, а не текущая: иначе один вызов дробится на десятки узлов графа
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    # формат folded stacks (flamegraph.pl, speedscope): от корня к вершине через «;», число — после последнего пробела
+    return ";".join(reversed(names))
+
+class Stall:
+    __slots__ = ("started", "handler", "stack", "duration_ms")
+
+    def __init__(self, started: float, handler: str | None, stack: str):
+        self.started = started
+        self.handler = handler
+        self.stack = stack
+        self.duration_ms: float | None = None
+
+# Тик в event loop отмечает время, отдельный поток замечает, что тики прекратились, и снимает стек
+# потока event loop'а — пока блокировка ещё идёт, а не после неё
+class LoopWatchdog:
+    def __init__(
+        self, interval_ms: float = LOOP_WATCHDOG_INTERVAL_MS, threshold_ms: float = LOOP_LAG_THRESHOLD_MS,
+        profile_dir: str = PROFILE_DIR, profile_interval_ms: float = PROFILE_INTERVAL_MS,
+    ):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.profile_dir = profile_dir
+        self.profile_interval = profile_interval_ms / 1000
+        self.stalls: deque[Stall] = deque(maxlen=LOOP_STALL_HISTORY)
+        # (метка, свёрнутый стек) → число сэмплов; метка — обработчик или имя пула потоков
+        self.samples: Counter = Counter()
+        self._last_tick = time.monotonic()
+        self._current: Stall | None = None
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            logger.info("Сэмплирующий профилировщик пишет в %s каждые %.0f с", self.profile_dir, PROFILE_FLUSH_S)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stopped.set()
+        await asyncio.to_thread(self._thread.join)
+        if self.profile_dir:
+            self.write_profiles()
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._last_tick = time.monotonic()
+            loop_lag.observe(lag)
+            stall = self._current
+            if stall is not None:
+                self._current = None
+                stall.duration_ms = (self._last_tick - stall.started) * 1000
+                logger.warning(
+                    "Event loop был заблокирован %.0f мс (обработчик: %s)", stall.duration_ms, stall.handler or "—",
+                )
+
+    def _watch(self) -> None:
+        step = min(self.interval, self.profile_interval) if self.profile_dir else self.interval
+        next_flush = time.monotonic() + PROFILE_FLUSH_S
+        while not self._stopped.wait(step):
+            now = time.monotonic()
+            frames = sys._current_frames()
+            loop_frame = frames.get(self._loop_thread_id)
+            if loop_frame is not None and self._current is None and now - self._last_tick > self.interval + self.threshold:
+                self._record_stall(loop_frame, self._last_tick + self.interval)
+            if self.profile_dir:
+                self._sample(frames)
+                if now >= next_flush:
+                    self.write_profiles()
+                    next_flush = now + PROFILE_FLUSH_S
+            del frames, loop_frame
+
+    def _record_stall(self, frame, started: float) -> None:
+        name = handler_name(frame)
+        stack = "".join(traceback.format_stack(frame))
+        stall = Stall(started, name, stack)
+        self._current = stall
+        self.stalls.append(stall)
+        loop_stalls.inc(handler=name or "none")
+        logger.warning(
+            "Event loop заблокирован дольше %.0f мс, обработчик: %s\n%s",
+            self.threshold * 1000, name or "—", stack,
+        )
+
+    def _sample(self, frames: dict) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in frames.items():
+            if thread_id == threading.get_ident() or _is_idle(frame):
+                continue
+            if thread_id == self._loop_thread_id:
+                label = handler_name(frame) or "event_loop"
+            else:
+                # inference_0, bcrypt_1 → inference, bcrypt
+                label = names.get(thread_id, "thread").rsplit("_", 1)[0]
+            self.samples[(label, _folded(frame))] += 1
+
+    # по файлу на метку: <метка>.<pid>.folded, накопленные сэмплы с момента запуска
+    def write_profiles(self) -> None:
+        by_label: dict[str, list[str]] = {}
+        for (label, stack), count in list(self.samples.items()):
+            by_label.setdefault(label, []).append(f"{stack} {count}")
+        for label, lines in by_label.items():
+            safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+            path = os.path.join(self.profile_dir, f"{safe}.{os.getpid()}.folded")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(path + ".tmp", path)
+
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,185 @@
+# bot/webhook.py
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import secrets
+import signal
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token; без него чужие POST примутся как апдейты
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# каждый воркер держит свою копию модели: число воркеров ограничено памятью не меньше, чем ядрами
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "2"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+SUPERVISE_INTERVAL_S = 5.0
+
+def update_chat_id(update: dict) -> int | None:
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        # message, edited_message, channel_post, my_chat_member, chat_join_request и т.п.
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        # inline_query, poll_answer, pre_checkout_query и прочие апдейты без чата
+        sender = payload.get("from") or payload.get("user")
+        if sender:
+            return sender["id"]
+    return None
+
+# Все апдейты одного чата попадают в один воркер: состояние ConversationHandler живёт в его памяти
+def shard_for(update: dict, shards: int) -> int:
+    chat_id = update_chat_id(update)
+    return 0 if chat_id is None else chat_id % shards
+
+def run_worker(index: int, count: int, token: str, inbox, model_ready, startup_profile: bool) -> None:
+    # Ctrl+C получает вся группа процессов; воркеры останавливает фронтенд через свою очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # intra-op потоки torch делятся между воркерами, иначе процессы конкурируют за одни ядра
+    os.environ.setdefault("INFERENCE_TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // count)))
+    from bot import main as bot_main
+    asyncio.run(_serve_worker(bot_main, index, token, inbox, model_ready, startup_profile))
+
+async def _serve_worker(bot_main, index: int, token: str, inbox, model_ready, startup_profile: bool) -> None:
+    from telegram import Update
+    bot_main.load_faq_index()
+    app = bot_main.build_application(token, with_updater=False)
+    app.bot_data.update(worker=index, model_ready=model_ready, startup_profile=startup_profile)
+    loop = asyncio.get_running_loop()
+    # initialize/start вручную: post_init и post_shutdown вызываются только из run_polling/run_webhook
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    logger.info("Воркер %d запущен", index)
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, inbox.get)
+            if raw is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(raw), app.bot))
+    finally:
+        await app.stop()
+        await app.post_shutdown(app)
+        await app.shutdown()
+
+class WorkerPool:
+    def __init__(self, token: str, count: int = BOT_WORKERS, startup_profile: bool = False):
+        self.token = token
+        self.count = count
+        self.startup_profile = startup_profile
+        self._ctx = mp.get_context("spawn")
+        self.inboxes = [self._ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(count)]
+        self.ready = [self._ctx.Event() for _ in range(count)]
+        self.processes: list = [None] * count
+
+    def start(self, index: int) -> None:
+        self.ready[index].clear()
+        process = self._ctx.Process(
+            target=run_worker, name=f"bot-worker-{index}",
+            args=(index, self.count, self.token, self.inboxes[index], self.ready[index], self.startup_profile),
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start_all(self) -> None:
+        for index in range(self.count):
+            self.start(index)
+
+    def dispatch(self, raw: bytes, update: dict) -> bool:
+        try:
+            self.inboxes[shard_for(update, self.count)].put_nowait(raw)
+        except queue.Full:
+            return False
+        return True
+
+    def is_ready(self) -> bool:
+        return all(p is not None and p.is_alive() for p in self.processes) and all(e.is_set() for e in self.ready)
+
+    # упавший воркер перезапускается; его очередь сохраняется, апдейты шарда дождутся нового процесса
+    async def supervise(self) -> None:
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL_S)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error("Воркер %d завершился с кодом %s, перезапуск", index, process.exitcode)
+                    self.start(index)
+
+    def stop(self, timeout_s: float = 30) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout_s)
+                if process.is_alive():
+                    process.terminate()
+
+def build_frontend(pool: WorkerPool):
+    from aiohttp import web
+
+    async def receive_update(request):
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        raw = await request.read()
+        try:
+            update = json.loads(raw)
+        except ValueError:
+            return web.Response(status=400)
+        # очередь шарда переполнена: Telegram повторит доставку позже
+        if not pool.dispatch(raw, update):
+            return web.Response(status=503)
+        return web.Response()
+
+    # готовность — все воркеры живы и загрузили модель; до этого балансировщику рано слать трафик
+    async def ready(request):
+        if pool.is_ready():
+            return web.Response(text="ready")
+        return web.Response(status=503, text="starting")
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, receive_update)
+    web_app.router.add_get("/ready", ready)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+async def _run_frontend(pool: WorkerPool, token: str) -> None:
+    from aiohttp import web
+    from telegram import Bot
+
+    runner = web.AppRunner(build_frontend(pool))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook слушает %s:%d%s, воркеров: %d", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, pool.count)
+    async with Bot(token) as bot:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=100,
+        )
+    try:
+        await pool.supervise()
+    finally:
+        await runner.cleanup()
+
+def serve(token: str, startup_profile: bool = False) -> None:
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook задайте WEBHOOK_URL (публичный https-адрес бота)")
+    pool = WorkerPool(token, startup_profile=startup_profile)
+    pool.start_all()
+    try:
+        asyncio.run(_run_frontend(pool, token))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
@@ -1,10 +1,31 @@
 # db/init_db.py
-from db.database import engine, Base
-import db.models  # noqa: F401
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from db.database import engine
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+# ревизия, соответствующая схеме, которую раньше создавал Base.metadata.create_all
+BASELINE_REVISION = "0001"
+
+def alembic_config(configure_logger: bool = True) -> Config:
+    cfg = Config(str(ALEMBIC_INI))
+    cfg.set_main_option("script_location", str(ALEMBIC_INI.parent / "db" / "migrations"))
+    cfg.attributes["configure_logger"] = configure_logger
+    return cfg
+
+def upgrade_db(revision: str = "head", configure_logger: bool = True) -> None:
+    cfg = alembic_config(configure_logger)
+    tables = set(inspect(engine).get_table_names())
+    # база создана через create_all до появления миграций: фиксируем её как базовую ревизию
+    if "users" in tables and "alembic_version" not in tables:
+        command.stamp(cfg, BASELINE_REVISION)
+    command.upgrade(cfg, revision)
 
 def init_db():
-    print("Создание таблиц…")
-    Base.metadata.create_all(bind=engine)
+    print("Применение миграций…")
+    upgrade_db()
     print("Готово ✅")
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+"""indexes for hot lookup columns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_user_activity_user_id_timestamp", "user_activity", ["user_id", sa.text("timestamp DESC")]),
+    ("ix_user_activity_timestamp", "user_activity", ["timestamp"]),
+    ("ix_user_activity_handler_name_response_time", "user_activity", ["handler_name", "response_time_ms"]),
+    ("ix_users_role_id", "users", ["role_id"]),
+    ("ix_files_user_id", "files", ["user_id"]),
+    ("ix_user_feedback_user_id", "user_feedback", ["user_id"]),
+    ("ix_flashcard_reviews_card_id_review_time", "flashcard_reviews", ["card_id", "review_time"]),
+    ("ix_deadlines_deadline_at", "deadlines", ["deadline_at"]),
+]
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY не блокирует запись в user_activity, но не может выполняться в транзакции;
+    # if_not_exists позволяет просто перезапустить миграцию, если она прервалась на середине
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,33 @@
+"""pre-aggregated activity rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+Existing history is not aggregated here, run scripts/rebuild_rollups.py once after upgrading.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+HISTOGRAM_COLUMNS = ["le_50_ms", "le_100_ms", "le_250_ms", "le_500_ms", "le_1000_ms", "le_2500_ms", "le_5000_ms", "le_inf_ms"]
+
+def upgrade():
+    op.create_table('activity_rollups',
+    sa.Column('granularity', sa.String(length=8), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('handler_name', sa.String(length=100), nullable=False),
+    sa.Column('request_count', sa.Integer(), nullable=False),
+    sa.Column('response_time_sum_ms', sa.BigInteger(), nullable=False),
+    sa.Column('response_time_max_ms', sa.Integer(), nullable=False),
+    *[sa.Column(name, sa.Integer(), nullable=False) for name in HISTOGRAM_COLUMNS],
+    sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'user_id', 'handler_name')
+    )
+
+def downgrade():
+    op.drop_table('activity_rollups')
@@ -0,0 +1,28 @@
+"""persistent response cache
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('response_cache',
+    sa.Column('prompt_hash', sa.String(length=64), nullable=False),
+    sa.Column('model_revision', sa.String(length=64), nullable=False),
+    sa.Column('prompt_norm', sa.Text(), nullable=False),
+    sa.Column('answer', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('prompt_hash')
+    )
+    op.create_index(op.f('ix_response_cache_model_revision'), 'response_cache', ['model_revision'], unique=False)
+
+def downgrade():
+    op.drop_index(op.f('ix_response_cache_model_revision'), table_name='response_cache')
+    op.drop_table('response_cache')
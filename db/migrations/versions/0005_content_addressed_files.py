@@ -0,0 +1,36 @@
+"""content-addressed file blobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('telegram_unique_id', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_index(op.f('ix_blobs_telegram_unique_id'), 'blobs', ['telegram_unique_id'], unique=False)
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.add_column(sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_files_blob_sha256_blobs', 'blobs', ['blob_sha256'], ['sha256'])
+        batch_op.create_index(batch_op.f('ix_files_blob_sha256'), ['blob_sha256'], unique=False)
+
+def downgrade():
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_files_blob_sha256'))
+        batch_op.drop_constraint('fk_files_blob_sha256_blobs', type_='foreignkey')
+        batch_op.drop_column('blob_sha256')
+    op.drop_index(op.f('ix_blobs_telegram_unique_id'), table_name='blobs')
+    op.drop_table('blobs')
@@ -0,0 +1,29 @@
+"""telegram file_id reuse
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('files', sa.Column('telegram_file_id', sa.String(length=255), nullable=True))
+    op.create_table('telegram_artifacts',
+    sa.Column('repo_id', sa.String(length=255), nullable=False),
+    sa.Column('revision', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('file_id', sa.String(length=255), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('repo_id', 'revision', 'filename')
+    )
+
+def downgrade():
+    op.drop_table('telegram_artifacts')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('telegram_file_id')
@@ -0,0 +1,26 @@
+"""deadline reminder claims
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('deadlines', sa.Column('reminded_at', sa.DateTime(timezone=True), nullable=True))
+    # прошедшим дедлайнам напоминание уже не нужно: отметка убирает их из частичного индекса
+    op.execute("UPDATE deadlines SET reminded_at = CURRENT_TIMESTAMP WHERE deadline_at < CURRENT_TIMESTAMP")
+    op.create_index(
+        'ix_deadlines_pending_reminder', 'deadlines', ['deadline_at'], unique=False,
+        postgresql_where=sa.text('reminded_at IS NULL'), sqlite_where=sa.text('reminded_at IS NULL'),
+    )
+
+def downgrade():
+    op.drop_index('ix_deadlines_pending_reminder', table_name='deadlines')
+    op.drop_column('deadlines', 'reminded_at')
@@ -0,0 +1,34 @@
+"""flashcard spaced-repetition state
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # существующие карточки становятся к повторению сразу, с начальными параметрами SM-2
+    with op.batch_alter_table('flashcards') as batch_op:
+        batch_op.add_column(sa.Column('due_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+        batch_op.add_column(sa.Column('ease', sa.Float(), server_default='2.5', nullable=False))
+        batch_op.add_column(sa.Column('interval_days', sa.Float(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('repetitions', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_flashcards_user_id_due_at', 'flashcards', ['user_id', 'due_at'], unique=False)
+    op.create_index('ix_flashcards_due_at', 'flashcards', ['due_at'], unique=False)
+    op.add_column('flashcard_reviews', sa.Column('quality', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column('flashcard_reviews', 'quality')
+    op.drop_index('ix_flashcards_due_at', table_name='flashcards')
+    op.drop_index('ix_flashcards_user_id_due_at', table_name='flashcards')
+    with op.batch_alter_table('flashcards') as batch_op:
+        batch_op.drop_column('repetitions')
+        batch_op.drop_column('interval_days')
+        batch_op.drop_column('ease')
+        batch_op.drop_column('due_at')
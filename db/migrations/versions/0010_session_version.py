@@ -0,0 +1,21 @@
+"""session version for cross-process change detection
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+def downgrade():
+    with op.batch_alter_table('sessions') as batch_op:
+        batch_op.drop_column('version')
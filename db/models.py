@@ -1,5 +1,5 @@
 # db/models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, func
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Text, Float, Index, func
 from sqlalchemy.orm import relationship
 from db.database import Base
 
@@ -15,7 +15,7 @@ class User(Base):
     telegram_id   = Column(Integer, unique=True, nullable=True)
     username      = Column(String(255), unique=True, nullable=False)
     password_hash = Column(String(255), nullable=False)
-    role_id       = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    role_id       = Column(Integer, ForeignKey("roles.id"), nullable=False, index=True)
     registered_at = Column(DateTime(timezone=True), server_default=func.now())
 
     role         = relationship("Role", back_populates="users")
@@ -42,6 +42,55 @@ class UserActivity(Base):
 
     user = relationship("User", back_populates="activity")
 
+    __table_args__ = (
+        # «последние N запросов пользователя» и count/avg по пользователю
+        Index("ix_user_activity_user_id_timestamp", user_id, timestamp.desc()),
+        # группировка по дням
+        Index("ix_user_activity_timestamp", timestamp),
+        # топ хендлеров по числу запросов и времени ответа без чтения самой таблицы
+        Index("ix_user_activity_handler_name_response_time", handler_name, response_time_ms),
+    )
+
+# Инкрементальные агрегаты user_activity; user_id = 0 и handler_name = "" означают «все»
+class ActivityRollup(Base):
+    __tablename__ = "activity_rollups"
+    granularity = Column(String(8), primary_key=True)  # hour | day | total
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    handler_name = Column(String(100), primary_key=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    response_time_sum_ms = Column(BigInteger, nullable=False, default=0)
+    response_time_max_ms = Column(Integer, nullable=False, default=0)
+    le_50_ms = Column(Integer, nullable=False, default=0)
+    le_100_ms = Column(Integer, nullable=False, default=0)
+    le_250_ms = Column(Integer, nullable=False, default=0)
+    le_500_ms = Column(Integer, nullable=False, default=0)
+    le_1000_ms = Column(Integer, nullable=False, default=0)
+    le_2500_ms = Column(Integer, nullable=False, default=0)
+    le_5000_ms = Column(Integer, nullable=False, default=0)
+    le_inf_ms = Column(Integer, nullable=False, default=0)
+
+# Ответы модели по нормализованному промпту; строки другой ревизии модели удаляются при старте
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+    prompt_hash = Column(String(64), primary_key=True)
+    model_revision = Column(String(64), nullable=False, index=True)
+    prompt_norm = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+# Состояние авторизации из context.user_data, общее для всех процессов бота и переживающее перезапуск
+class Session(Base):
+    __tablename__ = "sessions"
+    telegram_id = Column(BigInteger, primary_key=True)
+    # users.id аккаунта, под которым выполнен вход (из одного Telegram можно войти в чужой аккаунт)
+    account_id = Column(Integer, nullable=True, index=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    # растёт с каждой записью сессии: по нему процессы замечают чужие изменения, не перечитывая data
+    version = Column(Integer, default=0, server_default="0", nullable=False)
+
 class UserSetting(Base):
     __tablename__ = "user_settings"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -73,10 +122,21 @@ class Flashcard(Base):
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # состояние SM-2 хранится в карточке: очередь повторения — один индексный запрос, без разбора истории
+    due_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    ease = Column(Float, default=2.5, server_default="2.5", nullable=False)
+    interval_days = Column(Float, default=0, server_default="0", nullable=False)
+    repetitions = Column(Integer, default=0, server_default="0", nullable=False)
 
     user = relationship("User", back_populates="flashcards")
     reviews = relationship("FlashcardReview", back_populates="card")
 
+    __table_args__ = (
+        Index("ix_flashcards_user_id_due_at", user_id, due_at),
+        # карточки, наступившие с прошлого прохода рассылки уведомлений
+        Index("ix_flashcards_due_at", due_at),
+    )
+
 class FlashcardReview(Base):
     __tablename__ = "flashcard_reviews"
     id = Column(Integer, primary_key=True)
@@ -84,9 +144,15 @@ class FlashcardReview(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     review_time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     success = Column(Boolean, nullable=False)
+    # оценка SM-2 от 0 до 5; у отзывов, записанных до её появления, пусто
+    quality = Column(Integer, nullable=True)
 
     card = relationship("Flashcard", back_populates="reviews")
 
+    __table_args__ = (
+        Index("ix_flashcard_reviews_card_id_review_time", card_id, review_time),
+    )
+
 class Reflection(Base):
     __tablename__ = "reflections"
     id = Column(Integer, primary_key=True)
@@ -111,21 +177,54 @@ class Deadline(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     event_name = Column(String(255))
-    deadline_at = Column(DateTime(timezone=True), nullable=True)
+    deadline_at = Column(DateTime(timezone=True), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # отметка ставится до отправки напоминания: после перезапуска оно не уйдёт повторно
+    reminded_at = Column(DateTime(timezone=True), nullable=True)
 
     user = relationship("User", back_populates="deadlines")
 
+    __table_args__ = (
+        # в индексе только ожидающие напоминания: отправленные не попадают в выборку ближайших
+        Index(
+            "ix_deadlines_pending_reminder", deadline_at,
+            postgresql_where=reminded_at.is_(None), sqlite_where=reminded_at.is_(None),
+        ),
+    )
+
+# Содержимое файла, адресуемое по SHA-256; одинаковые загрузки разных пользователей ссылаются на один blob
+class Blob(Base):
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # file_unique_id Telegram одинаков для одинаковых файлов: повторную загрузку можно узнать без скачивания
+    telegram_unique_id = Column(String(64), nullable=True, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 class File(Base):
     __tablename__ = "files"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     filename = Column(String(255), nullable=False)
+    # для новых записей — ключ в хранилище blob'ов, для старых — путь на диске
     file_path = Column(String(1024), nullable=False)
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)
+    # file_id Telegram для повторной отправки без загрузки байтов (действует только для этого бота)
+    telegram_file_id = Column(String(255), nullable=True)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     user = relationship("User", back_populates="files")
 
+# file_id отправленных артефактов модели; ключ включает ревизию хаба, новая ревизия отправляется заново
+class TelegramArtifact(Base):
+    __tablename__ = "telegram_artifacts"
+    repo_id = Column(String(255), primary_key=True)
+    revision = Column(String(64), primary_key=True)
+    filename = Column(String(255), primary_key=True)
+    file_id = Column(String(255), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 class ModelMetrics(Base):
     __tablename__ = "model_metrics"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -150,7 +249,7 @@ class ErrorLog(Base):
 class UserFeedback(Base):
     __tablename__ = "user_feedback"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     query_text = Column(Text, nullable=True)
     rating = Column(Integer, nullable=False)
     comment = Column(Text, nullable=True)
@@ -0,0 +1,392 @@
+# scripts/benchmark.py
+"""Нагрузочный прогон бота без Telegram.
+
+Синтетические апдейты подаются прямо в Application из bot/main.py, Bot API подменён заглушкой,
+БД — временный SQLite (или --database-url). Без локального снимка модели используется крошечная
+случайная GPT-2, собранная на лету: она измеряет накладные расходы бота, а не качество ответов.
+
+    python -m scripts.benchmark --users 50 --rate 20 --duration 30 --mix chat=60,login=10,stats_global=10,upload=10,feedback=10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+SCENARIOS = ("chat", "login", "stats_global", "upload", "feedback")
+CHAT_PROMPTS = [
+    "Когда начинается сессия?",
+    "Как скачать электронную книгу?",
+    "Где посмотреть расписание занятий?",
+    "Как подготовиться к экзамену по математике?",
+    "Что почитать по машинному обучению?",
+    "Как продлить книгу в библиотеке?",
+]
+PASSWORD = "BenchPass123!"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10, help="сценариев в секунду (пуассоновский поток)")
+    parser.add_argument("--duration", type=float, default=20, help="секунд подачи нагрузки")
+    parser.add_argument("--mix", default="chat=60,login=10,stats_global=10,upload=10,feedback=10")
+    parser.add_argument("--model", default="tiny", help="tiny | путь к снимку модели (scripts/snapshot_model.py)")
+    parser.add_argument("--database-url", default=None, help="по умолчанию временный SQLite")
+    parser.add_argument("--api-latency-ms", type=float, default=20, help="задержка заглушки Bot API")
+    parser.add_argument("--upload-kb", type=int, default=256)
+    parser.add_argument("--rate-limits", action="store_true", help="не отключать пользовательские лимиты bot/limits.py")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", default=None, help="сохранить результаты в JSON")
+    return parser.parse_args(argv)
+
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"неизвестный сценарий {name!r}, доступны: {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def build_tiny_model(model_dir: str) -> None:
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+    from bot.model_loader import SNAPSHOT_META
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=1000, special_tokens=["<unk>", "<|endoftext|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tokenizer.train_from_iterator(CHAT_PROMPTS + [f"<User>: {p}\n<Bot>: ответ" for p in CHAT_PROMPTS], trainer)
+    fast = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, eos_token="<|endoftext|>", unk_token="<unk>", pad_token="<|endoftext|>",
+    )
+    eos = fast.eos_token_id
+    model = GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(fast), n_layer=2, n_head=2, n_embd=64, n_positions=1024,
+        eos_token_id=eos, bos_token_id=eos, pad_token_id=eos,
+    ))
+    fast.save_pretrained(model_dir)
+    model.save_pretrained(model_dir, safe_serialization=True)
+    with open(os.path.join(model_dir, SNAPSHOT_META), "w", encoding="utf-8") as f:
+        json.dump({"repo": "benchmark/tiny-gpt2", "revision": "tiny"}, f)
+
+def configure_environment(args, workdir: str) -> None:
+    # до импорта bot.*: модули читают настройки из окружения при импорте
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["FILE_STORAGE"] = "local"
+    os.environ["FILE_STORAGE_DIR"] = os.path.join(workdir, "uploads")
+    os.environ.setdefault("DB_ECHO", "0")
+    # эндпоинт /metrics не нужен и мог бы занять порт работающего рядом бота
+    os.environ.setdefault("METRICS_PORT", "0")
+    if not args.rate_limits:
+        for name in ("LLM", "DB", "CHEAP"):
+            os.environ[f"LIMIT_{name}_RATE_PER_MIN"] = "1000000"
+            os.environ[f"LIMIT_{name}_BURST"] = "1000000"
+    # MODEL_DIR задаётся до импорта bot.model_loader: путь по умолчанию фиксируется при импорте
+    if args.model == "tiny":
+        os.environ["MODEL_DIR"] = os.path.join(workdir, "tiny-model")
+        build_tiny_model(os.environ["MODEL_DIR"])
+    else:
+        os.environ["MODEL_DIR"] = args.model
+
+# Заглушка транспорта Bot API: отвечает правдоподобными объектами после искусственной задержки
+def make_stub_request(latency_s: float, files: dict):
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        def __init__(self):
+            self.calls = defaultdict(int)
+            self._ids = itertools.count(1)
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            endpoint = url.rsplit("/", 1)[-1]
+            self.calls[endpoint] += 1
+            params = request_data.parameters if request_data else {}
+            if latency_s:
+                await asyncio.sleep(latency_s)
+            return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+        def _result(self, endpoint: str, params: dict):
+            if endpoint == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            if endpoint == "getFile":
+                path, unique_id = files[params["file_id"]]
+                return {"file_id": params["file_id"], "file_unique_id": unique_id, "file_path": path}
+            if endpoint in ("sendMessage", "editMessageText", "sendDocument", "sendPhoto"):
+                n = next(self._ids)
+                message = {
+                    "message_id": n, "date": int(time.time()),
+                    "chat": {"id": int(params.get("chat_id", 0) or 0), "type": "private"},
+                    "text": params.get("text", ""),
+                }
+                if endpoint == "sendDocument":
+                    message["document"] = {"file_id": f"out-doc-{n}", "file_unique_id": f"out-u-{n}"}
+                if endpoint == "sendPhoto":
+                    message["photo"] = [{"file_id": f"out-photo-{n}", "file_unique_id": f"out-p-{n}", "width": 1, "height": 1}]
+                return message
+            return True
+
+    return StubRequest()
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, telegram_id: int) -> dict:
+        return {"id": telegram_id, "is_bot": False, "first_name": f"bench{telegram_id}"}
+
+    def message(self, telegram_id: int, text: str | None = None, document: dict | None = None) -> dict:
+        message = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"}, "from": self._user(telegram_id),
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if document is not None:
+            message["document"] = document
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, telegram_id: int, data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)), "from": self._user(telegram_id), "chat_instance": "bench", "data": data,
+                "message": {
+                    "message_id": next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": telegram_id, "type": "private"}, "text": "Оцените ответ:",
+                },
+            },
+        }
+
+class Benchmark:
+    def __init__(self, args, app, files: dict, upload_ids: list):
+        self.args = args
+        self.app = app
+        self.files = files
+        self.upload_ids = upload_ids
+        self.updates = UpdateFactory()
+        self.rng = random.Random(args.seed)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.loop_lag: list[float] = []
+        self.errors = 0
+        self.completed = 0
+        self._locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def users(self) -> list[int]:
+        return [100_000 + i for i in range(self.args.users)]
+
+    async def send(self, label: str, raw: dict) -> None:
+        from telegram import Update
+        update = Update.de_json(raw, self.app.bot)
+        started = time.perf_counter()
+        # тот же путь, что у Updater: процессор апдейтов PTB с его ограничением параллельности
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        self.latencies[label].append((time.perf_counter() - started) * 1000)
+        self.completed += 1
+
+    async def login(self, telegram_id: int) -> None:
+        await self.send("login_start", self.updates.message(telegram_id, "/login"))
+        await self.send("login_username", self.updates.message(telegram_id, f"bench{telegram_id}@example.com"))
+        await self.send("login_password", self.updates.message(telegram_id, PASSWORD))
+
+    async def run_scenario(self, name: str, telegram_id: int) -> None:
+        # диалоги (вход, загрузка) одного пользователя не должны перемешиваться
+        async with self._locks[telegram_id]:
+            if name == "chat":
+                await self.send("chat", self.updates.message(telegram_id, self.rng.choice(CHAT_PROMPTS)))
+            elif name == "login":
+                await self.login(telegram_id)
+            elif name == "stats_global":
+                await self.send("stats_global", self.updates.message(telegram_id, "/stats_global"))
+            elif name == "upload":
+                file_id = self.rng.choice(self.upload_ids)
+                document = {
+                    "file_id": file_id, "file_unique_id": self.files[file_id][1],
+                    "file_name": f"{file_id}.bin", "file_size": self.args.upload_kb * 1024,
+                }
+                await self.send("upload_start", self.updates.message(telegram_id, "/upload"))
+                await self.send("upload_file", self.updates.message(telegram_id, document=document))
+            elif name == "feedback":
+                await self.send("feedback", self.updates.callback(telegram_id, self.rng.choice(["like", "dislike"])))
+
+    async def measure_loop_lag(self, interval_s: float = 0.01) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval_s)
+            self.loop_lag.append((loop.time() - started - interval_s) * 1000)
+
+    async def run(self, mix: dict[str, float]) -> float:
+        names, weights = list(mix), list(mix.values())
+        users = self.users()
+        tasks = set()
+
+        async def guarded(name, telegram_id):
+            try:
+                await self.run_scenario(name, telegram_id)
+            except Exception:
+                self.errors += 1
+
+        lag_task = asyncio.create_task(self.measure_loop_lag())
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        # открытая модель нагрузки: новые сценарии приходят независимо от того, успевает ли бот
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            task = asyncio.create_task(guarded(name, self.rng.choice(users)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        lag_task.cancel()
+        return elapsed
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+def summarize(bench: Benchmark, elapsed: float, stub) -> dict:
+    handlers = {
+        label: {
+            "count": len(values),
+            "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95), "p99_ms": percentile(values, 99),
+            "max_ms": max(values),
+        }
+        for label, values in sorted(bench.latencies.items())
+    }
+    return {
+        "elapsed_s": elapsed,
+        "updates": bench.completed,
+        "throughput_updates_per_s": bench.completed / elapsed if elapsed else 0.0,
+        "errors": bench.errors,
+        "handlers": handlers,
+        "loop_lag_ms": {
+            "p50": percentile(bench.loop_lag, 50), "p99": percentile(bench.loop_lag, 99),
+            "max": max(bench.loop_lag, default=float("nan")),
+        },
+        # ru_maxrss в Linux в килобайтах
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "bot_api_calls": dict(stub.calls),
+    }
+
+def print_report(result: dict) -> None:
+    print(f"\n{'обработчик':<16}{'N':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (мс)")
+    for label, h in result["handlers"].items():
+        print(f"{label:<16}{h['count']:>7}{h['p50_ms']:>10.1f}{h['p95_ms']:>10.1f}{h['p99_ms']:>10.1f}{h['max_ms']:>10.1f}")
+    lag = result["loop_lag_ms"]
+    print(f"\nапдейтов: {result['updates']} за {result['elapsed_s']:.1f} с — {result['throughput_updates_per_s']:.1f}/с, ошибок: {result['errors']}")
+    print(f"задержка event loop: p50 {lag['p50']:.1f} мс, p99 {lag['p99']:.1f} мс, max {lag['max']:.1f} мс")
+    print(f"пиковый RSS: {result['peak_rss_mb']:.0f} МБ")
+
+async def seed_users(telegram_ids: list[int]) -> None:
+    from sqlalchemy import select
+    from db.database import get_async_db
+    from db.models import Role, User
+    from bot.passwords import password_hasher
+
+    # один хеш на всех: сидирование не должно занимать users × 250 мс
+    password_hash = password_hasher.hash_sync(PASSWORD)
+    async with get_async_db() as db:
+        roles = {r.name: r for r in (await db.scalars(select(Role))).all()}
+        for name in ("admin", "manager", "client"):
+            if name not in roles:
+                roles[name] = Role(name=name)
+                db.add(roles[name])
+        await db.flush()
+        existing = set((await db.scalars(select(User.telegram_id).where(User.telegram_id.in_(telegram_ids)))).all())
+        db.add_all(
+            User(telegram_id=tid, username=f"bench{tid}@example.com", password_hash=password_hash, role_id=roles["admin"].id)
+            for tid in telegram_ids if tid not in existing
+        )
+        await db.commit()
+
+def make_upload_files(workdir: str, size_kb: int, count: int = 8) -> dict:
+    files = {}
+    for i in range(count):
+        path = os.path.join(workdir, f"upload-{i}.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size_kb * 1024))
+        # file_unique_id у Telegram один на содержимое; часть загрузок повторяется и проходит дедупликацию
+        files[f"in-doc-{i}"] = (path, f"in-u-{i}")
+    return files
+
+async def run_benchmark(args, workdir: str) -> dict:
+    from bot import main as bot_main
+    from bot.handlers import chat
+    from db.init_db import upgrade_db
+
+    await asyncio.to_thread(upgrade_db, "head", False)
+    files = make_upload_files(workdir, args.upload_kb)
+    stub = make_stub_request(args.api_latency_ms / 1000, files)
+    bot_main.load_faq_index()
+    app = bot_main.build_application("123456:benchmark", with_updater=False, request=stub)
+
+    errors = []
+    async def count_error(update, context):
+        errors.append(context.error)
+    app.add_error_handler(count_error)
+
+    bench = Benchmark(args, app, files, list(files))
+    await seed_users(bench.users())
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    try:
+        print("Ожидание загрузки модели…", file=sys.stderr)
+        while chat.engine is None:
+            await asyncio.sleep(0.1)
+        # прогрев: все пользователи входят в систему, чтобы сессии и роли были на месте
+        await asyncio.gather(*(bench.login(tid) for tid in bench.users()))
+        bench.latencies.clear()
+        bench.completed = 0
+        errors.clear()
+        elapsed = await bench.run(parse_mix(args.mix))
+    finally:
+        await app.stop()
+        await app.post_shutdown(app)
+        await app.shutdown()
+    result = summarize(bench, elapsed, stub)
+    result["errors"] += len(errors)
+    if errors:
+        result["first_error"] = repr(errors[0])
+    return result
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        configure_environment(args, workdir)
+        result = asyncio.run(run_benchmark(args, workdir))
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
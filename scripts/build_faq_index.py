@@ -0,0 +1,15 @@
+# scripts/build_faq_index.py
+import sys
+from bot.faq import FAQ_INDEX_PATH, build_index
+
+# CSV с колонками question, answer, category — тот же, что использовался для генерации датасета
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python -m scripts.build_faq_index <faq.csv> [путь_к_индексу]")
+        return
+    index_path = sys.argv[2] if len(sys.argv) > 2 else FAQ_INDEX_PATH
+    count = build_index(sys.argv[1], index_path)
+    print(f"Индекс FAQ собран: {count} вопросов → {index_path}.npy")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# scripts/rebuild_rollups.py
+from sqlalchemy import delete, select
+from db.database import get_db
+from db.models import ActivityRollup, UserActivity
+from bot.rollups import aggregate, upsert_statements
+
+CHUNK_SIZE = 5000
+
+# Пересчитывает activity_rollups по всей истории user_activity (однократно после миграции 0003)
+def rebuild():
+    with get_db() as db:
+        dialect_name = db.bind.dialect.name
+        db.execute(delete(ActivityRollup))
+        last_id, total = 0, 0
+        while True:
+            rows = db.execute(
+                select(
+                    UserActivity.id, UserActivity.user_id, UserActivity.timestamp,
+                    UserActivity.handler_name, UserActivity.response_time_ms,
+                )
+                .where(UserActivity.id > last_id)
+                .order_by(UserActivity.id)
+                .limit(CHUNK_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            for stmt in upsert_statements(dialect_name, aggregate(rows)):
+                db.execute(stmt)
+            last_id = rows[-1]["id"]
+            total += len(rows)
+            print(f"Обработано строк: {total}")
+        db.commit()
+    print("Агрегаты пересчитаны.")
+
+if __name__ == "__main__":
+    rebuild()
@@ -1,12 +1,14 @@
 # scripts/seed_users.py
-import bcrypt
 from db.database import get_db
 from db.models import Role, User
+from bot.passwords import password_hasher
 
 def get_password_hash(plain: str) -> str:
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt()).decode()
+    return password_hasher.hash_sync(plain)
 
 def seed():
+    # та же стоимость, что выберет бот при запуске
+    password_hasher.calibrate()
     with get_db() as db:
         existing = {r.name for r in db.query(Role).all()}
         for r in ("admin", "manager", "client"):
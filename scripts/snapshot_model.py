@@ -0,0 +1,29 @@
+# scripts/snapshot_model.py
+import json
+import os
+import sys
+from dotenv import load_dotenv
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from bot.model_loader import HUB_REPO_ID, MODEL_DIR, SNAPSHOT_META
+
+# Скачивает закреплённую ревизию модели и сохраняет её локально в safetensors, чтобы бот стартовал без хаба
+def snapshot(revision: str, model_dir: str = MODEL_DIR):
+    load_dotenv()
+    hf_token = os.getenv("HUGGINGFACE_TOKEN")
+    tokenizer = AutoTokenizer.from_pretrained(HUB_REPO_ID, revision=revision, token=hf_token)
+    model = AutoModelForCausalLM.from_pretrained(HUB_REPO_ID, revision=revision, token=hf_token)
+    # делаем один раз здесь, а не при каждом запуске бота
+    if tokenizer.pad_token_id is None:
+        tokenizer.add_special_tokens({"pad_token": tokenizer.eos_token})
+        model.resize_token_embeddings(len(tokenizer))
+    commit = getattr(model.config, "_commit_hash", None) or revision
+
+    os.makedirs(model_dir, exist_ok=True)
+    model.save_pretrained(model_dir, safe_serialization=True)
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, SNAPSHOT_META), "w", encoding="utf-8") as f:
+        json.dump({"repo": HUB_REPO_ID, "revision": commit}, f, ensure_ascii=False, indent=2)
+    print(f"Снимок {HUB_REPO_ID}@{commit} сохранён в {model_dir}")
+
+if __name__ == "__main__":
+    snapshot(sys.argv[1] if len(sys.argv) > 1 else os.getenv("MODEL_REVISION", "main"))
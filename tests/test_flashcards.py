@@ -0,0 +1,89 @@
+# tests/test_flashcards.py
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+# БД задаётся до импорта db.database: движки создаются при импорте
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "flashcards.db")
+
+import pytest
+from db.database import engine, get_async_db
+from db.models import Base, Flashcard, FlashcardReview
+from bot.flashcards import MIN_EASE, ReviewLog, due_cards, review_log, sm2
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def test_sm2_interval_sequence():
+    state = sm2(2.5, 0.0, 0, 4, NOW)
+    assert (state.repetitions, state.interval_days) == (1, 1.0)
+    state = sm2(state.ease, state.interval_days, state.repetitions, 4, NOW)
+    assert (state.repetitions, state.interval_days) == (2, 6.0)
+    ease = state.ease
+    state = sm2(state.ease, state.interval_days, state.repetitions, 5, NOW)
+    assert state.repetitions == 3
+    assert state.interval_days == round(6.0 * state.ease)
+    assert state.ease == pytest.approx(ease + 0.1)
+    assert state.due_at == NOW + timedelta(days=state.interval_days)
+
+def test_sm2_ease_floor():
+    state = sm2(MIN_EASE + 0.05, 6.0, 2, 3, NOW)
+    assert state.ease == MIN_EASE
+    state = sm2(state.ease, state.interval_days, state.repetitions, 3, NOW)
+    assert state.ease == MIN_EASE
+
+def test_sm2_lapse_keeps_ease():
+    state = sm2(2.3, 15.0, 3, 1, NOW)
+    assert state.ease == 2.3
+    assert (state.repetitions, state.interval_days) == (0, 0.0)
+    assert NOW < state.due_at < NOW + timedelta(days=1)
+
+@pytest.fixture
+def cards():
+    Base.metadata.create_all(engine, tables=[Flashcard.__table__, FlashcardReview.__table__])
+
+    async def add():
+        past = datetime.now(timezone.utc) - timedelta(hours=1)
+        async with get_async_db() as db:
+            rows = [Flashcard(user_id=1, question=f"q{i}", answer=f"a{i}", due_at=past + timedelta(seconds=i)) for i in range(3)]
+            db.add_all(rows)
+            await db.commit()
+            return [row.id for row in rows]
+
+    ids = asyncio.run(add())
+    yield ids
+    review_log._reviews.clear()
+    review_log._states.clear()
+    Base.metadata.drop_all(engine, tables=[Flashcard.__table__, FlashcardReview.__table__])
+
+def test_due_cards_prefers_pending_state(cards):
+    now = datetime.now(timezone.utc)
+    # оценка ещё не записана в БД: карточка не должна вернуться в очередь со старым сроком
+    review_log.record(cards[0], 1, 4, sm2(2.5, 0.0, 0, 4, now), now)
+    assert [card.id for card in asyncio.run(due_cards(1))] == cards[1:]
+
+def test_due_cards_pending_state_due_again(cards):
+    now = datetime.now(timezone.utc)
+    # «Снова» с уже истёкшей задержкой: карточка снова в очереди
+    review_log.record(cards[0], 1, 1, sm2(2.5, 0.0, 0, 1, now)._replace(due_at=now - timedelta(seconds=1)), now)
+    assert [card.id for card in asyncio.run(due_cards(1))] == cards
+
+def test_due_cards_limit_not_short(cards):
+    now = datetime.now(timezone.utc)
+    review_log.record(cards[0], 1, 4, sm2(2.5, 0.0, 0, 4, now), now)
+    assert [card.id for card in asyncio.run(due_cards(1, limit=2))] == cards[1:]
+
+def test_flush_clears_written_states(cards):
+    log = ReviewLog()
+    now = datetime.now(timezone.utc)
+    state = sm2(2.5, 0.0, 0, 5, now)
+    log.record(cards[0], 1, 5, state, now)
+    asyncio.run(log.flush())
+    assert log.pending_state(cards[0]) is None
+
+    async def stored():
+        async with get_async_db() as db:
+            return await db.get(Flashcard, cards[0])
+
+    card = asyncio.run(stored())
+    assert (card.repetitions, card.interval_days) == (1, 1.0)
@@ -0,0 +1,64 @@
+# tests/test_sessions.py
+import asyncio
+import json
+import os
+import tempfile
+
+# БД задаётся до импорта db.database: движки создаются при импорте
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "sessions.db"))
+
+import pytest
+from sqlalchemy import select
+from db.database import engine, get_async_db
+from db.models import Base, Session
+from bot.sessions import SessionPersistence
+
+USER = 7
+LOGIN = {"is_authenticated": True, "user_id": 1, "username": "u", "role": "client"}
+
+@pytest.fixture
+def sessions():
+    Base.metadata.create_all(engine, tables=[Session.__table__])
+    yield
+    Base.metadata.drop_all(engine, tables=[Session.__table__])
+
+async def _stored_role() -> str:
+    async with get_async_db() as db:
+        return json.loads(await db.scalar(select(Session.data)))["role"]
+
+def test_role_change_reaches_other_process(sessions):
+    # два процесса бота и третий, где администратор меняет роль; интервал сверки не истекает
+    worker, other, admin = (SessionPersistence(refresh_s=3600) for _ in range(3))
+
+    async def run():
+        user_data = dict(LOGIN)
+        await worker.update_user_data(USER, user_data)
+        await worker.flush()
+        other_data = {}
+        await other.refresh_user_data(USER, other_data)
+        assert other_data == LOGIN
+
+        await admin.update_role(1, "manager")
+        await worker.refresh_user_data(USER, user_data)
+        await other.refresh_user_data(USER, other_data)
+        return user_data["role"], other_data["role"]
+
+    assert asyncio.run(run()) == ("manager", "manager")
+
+def test_stale_write_keeps_changed_role(sessions):
+    worker, admin = SessionPersistence(refresh_s=3600), SessionPersistence()
+
+    async def run():
+        user_data = dict(LOGIN)
+        await worker.update_user_data(USER, user_data)
+        await worker.flush()
+        # локальное изменение посчитано до смены роли, а записывается после
+        user_data["username"] = "renamed"
+        await worker.update_user_data(USER, user_data)
+        await admin.update_role(1, "manager")
+        await worker.flush()
+        assert await _stored_role() == "manager"
+        await worker.refresh_user_data(USER, user_data)
+        return user_data
+
+    assert asyncio.run(run()) == {**LOGIN, "username": "renamed", "role": "manager"}
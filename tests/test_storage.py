@@ -0,0 +1,123 @@
+# tests/test_storage.py
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+# БД задаётся до импорта db.database: движки создаются при импорте
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "storage.db"))
+
+import pytest
+from sqlalchemy import event, select
+from db.database import async_engine, engine, get_async_db
+from db.models import Base, Blob, File, Role, User
+import bot.handlers.files as files
+from bot.storage import LocalBlobStorage, blob_key, file_store
+
+def _foreign_keys_on(dbapi_connection, connection_record):
+    # SQLite проверяет внешние ключи только с этой прагмой, Postgres — всегда
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    Base.metadata.create_all(engine)
+    event.listen(async_engine.sync_engine, "connect", _foreign_keys_on)
+    asyncio.run(async_engine.dispose())
+
+    async def add_user():
+        async with get_async_db() as db:
+            role = Role(name="client")
+            db.add(role)
+            await db.flush()
+            user = User(telegram_id=7, username="u", password_hash="", role_id=role.id)
+            db.add(user)
+            await db.commit()
+            return user.id
+
+    local = LocalBlobStorage(str(tmp_path / "blobs"))
+    monkeypatch.setattr(file_store, "_storage", local)
+    yield SimpleNamespace(storage=local, user_id=asyncio.run(add_user()), tmp=tmp_path)
+    event.remove(async_engine.sync_engine, "connect", _foreign_keys_on)
+    asyncio.run(async_engine.dispose())
+    Base.metadata.drop_all(engine)
+
+def _context(user_id: int, source: str, unique_id: str):
+    context = SimpleNamespace(identity=SimpleNamespace(user_id=user_id), user_data={}, bot=MagicMock())
+    context.bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path=source, file_unique_id=unique_id))
+    return context
+
+def _upload(env, content: bytes, unique_id: str, name: str = "a.txt") -> None:
+    source = env.tmp / f"{unique_id}.src"
+    source.write_bytes(content)
+    message = MagicMock()
+    message.reply_text = AsyncMock()
+    message.document = SimpleNamespace(file_id=f"id-{unique_id}", file_unique_id=unique_id, file_name=name)
+    update = SimpleNamespace(message=message, callback_query=None, effective_user=SimpleNamespace(id=7))
+    asyncio.run(files.receive_file(update, _context(env.user_id, str(source), unique_id)))
+
+def _delete(env, file_id: int) -> None:
+    query = MagicMock()
+    query.data = f"delete_{file_id}"
+    query.answer = AsyncMock()
+    query.edit_message_text = AsyncMock()
+    update = SimpleNamespace(message=None, callback_query=query, effective_user=SimpleNamespace(id=7))
+    asyncio.run(files.delete_file(update, _context(env.user_id, "", "")))
+
+def _rows(model):
+    async def load():
+        async with get_async_db() as db:
+            return (await db.scalars(select(model))).all()
+    return asyncio.run(load())
+
+def test_local_storage_sharded_paths(tmp_path):
+    storage = LocalBlobStorage(str(tmp_path))
+    sha = "ab" + "cd" + "0" * 60
+    assert blob_key(sha) == f"ab/cd/{sha}"
+    assert storage.path(blob_key(sha)) == os.path.join(str(tmp_path), "ab", "cd", sha)
+
+    for _ in range(2):
+        fd, staged = tempfile.mkstemp(dir=storage.staging_dir)
+        os.write(fd, b"data")
+        os.close(fd)
+        asyncio.run(storage.put(blob_key(sha), staged))
+        # staged-файл забирается и тогда, когда такое содержимое уже лежит в хранилище
+        assert not os.path.exists(staged)
+    with open(storage.path(blob_key(sha)), "rb") as f:
+        assert f.read() == b"data"
+    asyncio.run(storage.delete(blob_key(sha)))
+    asyncio.run(storage.delete(blob_key(sha)))
+    assert not os.path.exists(storage.path(blob_key(sha)))
+
+def test_identical_uploads_share_blob(storage):
+    _upload(storage, b"same content", "U1")
+    # то же содержимое под другим file_unique_id находится по SHA-256
+    _upload(storage, b"same content", "U2", name="b.txt")
+    blobs = _rows(Blob)
+    assert [blob.ref_count for blob in blobs] == [2]
+    assert {f.blob_sha256 for f in _rows(File)} == {blobs[0].sha256}
+    assert os.path.exists(storage.storage.path(blob_key(blobs[0].sha256)))
+
+def test_release_keeps_shared_blob(storage):
+    _upload(storage, b"same content", "U1")
+    _upload(storage, b"same content", "U1")
+    first, second = _rows(File)
+    _delete(storage, first.id)
+    [blob] = _rows(Blob)
+    assert blob.ref_count == 1
+    assert os.path.exists(storage.storage.path(blob_key(blob.sha256)))
+    _delete(storage, second.id)
+    assert _rows(Blob) == []
+    assert not os.path.exists(storage.storage.path(blob_key(blob.sha256)))
+
+def test_delete_last_reference_removes_blob(storage):
+    _upload(storage, b"only copy", "U1")
+    [record] = _rows(File)
+    path = storage.storage.path(blob_key(record.blob_sha256))
+    assert os.path.exists(path)
+    _delete(storage, record.id)
+    assert _rows(File) == []
+    assert _rows(Blob) == []
+    assert not os.path.exists(path)